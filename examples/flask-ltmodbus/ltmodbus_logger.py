@@ -30,8 +30,28 @@ from ltmodbus import LTModbusTCP, LTModbusSerial
 # csv format
 CSV_DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S"
 
+# times a failed frame read or move is tried again
+FRAME_RETRIES = 3
+
 path = op.join(op.dirname(__file__), 'files')
 
+def frame_timestamp(value):
+    """ convert a datetime, time tupple or timestamp to a frame timestamp
+    
+    frame dates are unit local time, and are kept as if they were utc.
+    """
+    
+    if value is None:
+        return None
+    
+    if isinstance(value, (int, long, float)):
+        return int(value)
+    
+    if hasattr(value, 'timetuple'):
+        value = value.timetuple()
+    
+    return calendar.timegm(tuple(value[:6]) + (0,0,0))
+
 class LTModbusLogger():
     """ a little modbus module
     
@@ -91,7 +111,13 @@ class LTModbusLogger():
         data = self.soc.get_par(self.unit, 5951, 18)
         
         # date and time are in pars 5941 ...
-        d,m,y,h,M,s = self.soc.get_par(self.unit, 5941, 6)
+        date = self.soc.get_par(self.unit, 5941, 6)
+        
+        # a failed request answers an empty list
+        if len(data) != 18 or len(date) != 6:
+            raise IOError("No answer from unit")
+        
+        d,m,y,h,M,s = date
         time_tuple = map(int, (y,m,d,h,M,s,0,0,0))
         
         try:
@@ -100,6 +126,70 @@ class LTModbusLogger():
             timestamp = 0
         
         return (timestamp,) + data
+    
+    def iter_frames(self, start=None, end=None, limit=None, retries=0):
+        """ read frames as they arrive
+        
+        start -- first frame date, None for the current frame
+        end -- stop when a frame date is after end, None for no time bound
+        limit -- max number of frames to read, None for no limit
+        retries -- times a failed frame read or move to the next frame is 
+            tried again before an IOError is raised
+        
+        return a generator of reading lines (timestamp, data... )
+        """
+        
+        if start is not None:
+            y,m,d,h,M,s = time.gmtime(frame_timestamp(start))[:6]
+            self.set_date(d,m,y,h,M,s)
+        
+        end = frame_timestamp(end)
+        
+        i = 0
+        while limit is None or i < limit:
+            frame = self._retry(self.read_data, retries)
+            
+            # stop before moving to the next frame
+            if end is not None and frame[0] > end:
+                return
+            
+            yield frame
+            
+            self._next_frame(frame[0], retries)
+            i += 1
+    
+    def _next_frame(self, timestamp, retries):
+        """ move the reading frame past the frame dated timestamp
+        
+        inc_date is not simply sent again when its answer is lost, the unit 
+        may have moved the frame anyway, the frame date is read to find out.
+        """
+        
+        for i in range(retries + 1):
+            # a failed set_par answers zeros or raises an IOError
+            try:
+                if self.inc_date()[0]:
+                    return
+            except IOError:
+                pass
+            
+            if self._retry(self.read_data, retries)[0] != timestamp:
+                return
+        
+        raise IOError("Can't move to the next frame")
+    
+    def _retry(self, function, retries):
+        """ call a function, and again up to retries times if it raises 
+        an IOError
+        """
+        
+        for i in range(retries):
+            try:
+                return function()
+            except IOError:
+                pass
+        
+        return function()
 
     def dump_line(self, f, frame):
         """ dump data line to data-base, csv-file and stdout
@@ -164,24 +254,23 @@ class LTModbusLogger():
             self.error = "Can't set data to unit"
         
         if self.error is None:
-            # read data
+            # read data until the end date
+            number = int(form.number.data)
             i = 0
-            while i < (int(form.number.data)) and self.run:
-                # get new data line
-                try:
-                    frame = self.read_data()
-                    self.inc_date()
-                    self.error = None
+            try:
+                for frame in self.iter_frames(end=form.todate.data, 
+                        limit=number, retries=FRAME_RETRIES):
+                    if not self.run:
+                        break
                     
                     # if we have valid line 
                     if frame[0] != 0:
                         self.dump_line(f, frame)
                     
-                except Exception, e:
-                    pass
-                    
-                self.busy_percent = 100.0 * float(i) / float(form.number.data)
-                i += 1
+                    self.busy_percent = 100.0 * float(i) / float(number)
+                    i += 1
+            except Exception, e:
+                self.error = "Can't read data from unit"
         
         f.close()
         self.soc.close()
@@ -25,9 +25,13 @@ A little modbus sub protocol for a data logger
 
 import os
 import sys
+import time
 
-from struct import pack,unpack
+from struct import Struct
 import socket
+import select
+
+from ltmodbus_crc import crc16, crc16_bytes, CRC16_STRUCT
 
 try:
     from serial import Serial
@@ -35,6 +39,136 @@ except:
     # no serial comunication
     pass
 
+# compiled struct formats
+GET_PAR_REQUEST = Struct('>2B2H')
+SET_PAR_ANSWER = Struct('>2H')
+MBAP_HEADER = Struct('>3H')
+ANSWER_HEADER = Struct('>3B')
+
+# max length of a MBAP frame, unit id and modbus message
+MAX_MBAP_LENGTH = 254
+
+# modbus exception codes
+MODBUS_EXCEPTIONS = {
+    1: 'Illegal function',
+    2: 'Illegal data address',
+    3: 'Illegal data value',
+    4: 'Slave device failure',
+    5: 'Acknowledge',
+    6: 'Slave device busy',
+    8: 'Memory parity error',
+    10: 'Gateway path unavailable',
+    11: 'Gateway target device failed to respond'}
+
+class LTModbusError(Exception):
+    """ a failed modbus request """
+    pass
+
+class LTModbusTimeout(LTModbusError):
+    """ the unit did not answer """
+    pass
+
+class LTModbusFrameError(LTModbusError):
+    """ the answer is corrupted or does not match the request """
+    pass
+
+class LTModbusCRCError(LTModbusFrameError):
+    """ the answer CRC is wrong """
+    pass
+
+class LTModbusConnectionError(LTModbusError):
+    """ the connection to the unit was closed or broken """
+    pass
+
+class LTModbusExceptionResponse(LTModbusError):
+    """ the unit answered with a modbus exception """
+    
+    def __init__(self, unit, function, code):
+        self.unit = unit
+        self.function = function
+        self.code = code
+        
+        LTModbusError.__init__(self, "Unit %d function %d exception %d: %s" % (
+            unit, function, code, MODBUS_EXCEPTIONS.get(code, 'Unknown')))
+
+# compiled struct formats keyed by paramters count
+FLOAT_STRUCTS = {}
+SET_PAR_STRUCTS = {}
+
+def float_struct(count):
+    """ get a compiled struct of count big endian floats """
+    
+    try:
+        return FLOAT_STRUCTS[count]
+    except KeyError:
+        FLOAT_STRUCTS[count] = Struct('>%df' % count)
+        return FLOAT_STRUCTS[count]
+
+def set_par_struct(count):
+    """ get a compiled struct of a set input registers request """
+    
+    try:
+        return SET_PAR_STRUCTS[count]
+    except KeyError:
+        SET_PAR_STRUCTS[count] = Struct('>2B2HB%df' % count)
+        return SET_PAR_STRUCTS[count]
+
+# max paramters in one request (125 modbus registers)
+MAX_READ_COUNT = 62
+
+# max unneeded paramters to read instead of sending another request
+MAX_READ_GAP = 8
+
+def plan_reads(addrs, max_gap=MAX_READ_GAP, max_count=MAX_READ_COUNT):
+    """ plan the requests needed to read a list of paramters
+    
+    addrs -- a list of paramter addresses
+    max_gap -- max number of unneeded paramters to read in one request
+    max_count -- max number of paramters in one request
+    
+    return -- a list of (addr, count) spans to read
+    """
+    
+    spans = []
+    for addr in sorted(set(addrs)):
+        if spans:
+            start, count = spans[-1]
+            end = addr + 1
+            if end - start <= max_count and addr - (start + count) <= max_gap:
+                spans[-1] = (start, end - start)
+                continue
+        
+        spans.append((addr, 1))
+    
+    return spans
+
+def check_crc(frame):
+    """ check the CRC of a RTU frame
+    
+    frame -- the frame chars including the 2 crc chars
+    
+    return -- the frame chars without the crc chars
+    """
+    
+    length = len(frame)
+    if crc16(frame[:length - 2]) != CRC16_STRUCT.unpack_from(frame, length - 2)[0]:
+        raise LTModbusCRCError("Bad CRC in answer")
+    
+    return frame[:length - 2]
+
+def scatter_reads(addrs, spans, answers):
+    """ get the paramter values out of the answers of planned spans
+    
+    return -- a dict of addr -> value, None for values that failed
+    """
+    
+    values = {}
+    for (start, count), answer in zip(spans, answers):
+        for i in range(count):
+            values[start + i] = answer[i] if answer else None
+    
+    return dict([(addr, values[addr]) for addr in addrs])
+
 class LTModbus():
     """ interface for a little modbus module
     
@@ -42,8 +176,34 @@ class LTModbus():
         parameters are two registers interpeted as floats, 
         the address of a paramters is addr/2 and the count of paramters is 
         count/2.
+    
+    get_par answers are cached when cache is a RegisterCache. cached 
+    answers are kept for each bus (serial port or gateway address), so one 
+    cache can be shared by several modules.
+    
+    failed requests raise a LTModbusError, answers are checked for CRC, 
+    unit, function code and length before they are used.
+    
+    requests are retried and timed out by retry when it is a RetryPolicy.
+    
+    every request calls the before and after methods of hooks, and cache
+    hits and misses call its event method, when hooks is set (see 
+    ltmodbus_metrics.Hooks).
     """
     
+    # register cache, None for no cache
+    cache = None
+    
+    # retry policy, None for no retries
+    retry = None
+    
+    # transaction hooks, None for no hooks
+    hooks = None
+    
+    # a late answer of a timed out request is never taken as the answer 
+    # of the next request
+    drops_late_answers = False
+    
     def send(self, msg, answer_length):
         """ send a message and wait for ans_length chars
         
@@ -55,75 +215,364 @@ class LTModbus():
         
         raise Exception("LTModbus::send - Not implementd")
     
+    def set_timeout(self, timeout):
+        """ set the answer timeout in seconds """
+        
+        pass
+    
+    def transfer_time(self, answer_length):
+        """ get the time in seconds needed to transfer an answer
+        
+        answer_length -- the answer length in chars
+        """
+        
+        return 0.0
+    
+    def bus(self):
+        """ get the bus this module talks on, units on one bus share 
+        cached answers
+        
+        return -- a hashable bus id
+        """
+        
+        return id(self)
+    
+    def invalidate(self, unit, addr=None, count=None):
+        """ drop cached answers of a unit
+        
+        unit -- modbus unit number
+        addr, count -- drop only answers that overlap these pars, 
+            None for all the answers of the unit
+        """
+        
+        if self.cache is not None:
+            self.cache.invalidate((self.bus(), unit), addr, count)
+    
     def get_par(self, unit, addr, count):
         """ get input registers from a modbus unit
-
+        
         unit -- modbus unit number
         addr -- start addres [par addr = modbus addr / 2]
         count -- number of registers to read [par count = modbus count / 2]
         """
         
+        # use cache
+        if self.cache is not None:
+            values = self.cache.get((self.bus(), unit), addr, count)
+            
+            if self.hooks is not None:
+                self.hooks.event(values is None and 'cache_miss' or 
+                    'cache_hit', unit)
+            
+            if values is not None:
+                return values
+        
+        msg, answer_length = self._get_par_request(unit, addr, count)
+        
+        # wait for answer
+        values = self._request(unit, msg, answer_length, 
+            self._get_par_answer)
+        
+        if self.cache is not None and values:
+            self.cache.put((self.bus(), unit), addr, count, values)
+        
+        return values
+    
+    def set_par(self, unit, addr, count, regs):
+        """ set input registers from in a modbus unit
+        
+        unit -- modbus unit number
+        addr -- start addres [par addr = modbus addr / 2]
+        count -- number of registers to read [par count = modbus count / 2]
+        regs -- an array of data to write
+        """
+        
+        # drop cached answers of the written pars
+        self.invalidate(unit, addr, count)
+        
+        msg, answer_length = self._set_par_request(unit, addr, count, regs)
+        
+        # wait for answer
+        return self._request(unit, msg, answer_length, 
+            self._set_par_answer, write=True)
+    
+    def get_raw(self, unit, addr, count):
+        """ get input registers from a modbus unit without decoding them
+        
+        the answer is not cached.
+        
+        unit -- modbus unit number
+        addr -- start addres [par addr = modbus addr / 2]
+        count -- number of registers to read [par count = modbus count / 2]
+        
+        return -- the registers content, 4 big endian chars for each 
+            paramter
+        """
+        
+        msg, answer_length = self._get_par_request(unit, addr, count)
+        
+        # wait for answer
+        return self._request(unit, msg, answer_length, 
+            self._get_raw_answer)
+    
+    def get_pars(self, requests):
+        """ get input registers from several blocks
+        
+        requests -- a list of (unit, addr, count) tupples
+        
+        return -- a list of answers, one for each request
+        """
+        
+        return [self.get_par(unit, addr, count) 
+            for unit, addr, count in requests]
+    
+    def set_pars(self, requests):
+        """ set input registers of several blocks
+        
+        requests -- a list of (unit, addr, count, regs) tupples
+        
+        return -- a list of answers, one for each request
+        """
+        
+        return [self.set_par(unit, addr, count, regs) 
+            for unit, addr, count, regs in requests]
+    
+    def read_many(self, unit, addrs, max_gap=MAX_READ_GAP):
+        """ get paramters from a list of scattered addresses
+        
+        nearby paramters are read together, using as few requests as
+        possible.
+        
+        unit -- modbus unit number
+        addrs -- a list of paramter addresses
+        max_gap -- max number of unneeded paramters to read between two 
+            needed paramters instead of sending another request
+        
+        return -- a dict of addr -> value
+        """
+        
+        spans = plan_reads(addrs, max_gap)
+        answers = self.get_pars([(unit, addr, count) for addr, count in spans])
+        
+        return scatter_reads(addrs, spans, answers)
+    
+    def _request(self, unit, msg, answer_length, parse, write=False):
+        """ send a request and parse its answer using the retry policy
+        
+        parse -- a function of (unit, replay, answer_length)
+        write -- the request writes to the unit
+        
+        return -- the parsed answer
+        """
+        
+        def request():
+            return parse(unit, self.send(msg, answer_length), answer_length)
+        
+        if self.hooks is not None:
+            request = self._hooked(unit, msg, answer_length, request)
+        
+        if self.retry is None:
+            return request()
+        
+        return self.retry.call(self, unit, request, write, answer_length)
+    
+    def _hooked(self, unit, msg, answer_length, request, token=None):
+        """ wrap a request function with the before and after hooks
+        
+        token -- the before hook token of a request that was already sent,
+            None to call the before hook in the wrapper
+        
+        return -- the wrapped function
+        """
+        
+        hooks = self.hooks
+        function = bytearray(msg[1:2])[0]
+        
+        def hooked():
+            start = token
+            if start is None:
+                start = hooks.before(unit, function)
+            
+            try:
+                result = request()
+            except LTModbusError as e:
+                hooks.after(unit, function, start, len(msg), 0, e)
+                raise
+            
+            hooks.after(unit, function, start, len(msg), answer_length)
+            
+            return result
+        
+        return hooked
+    
+    def _get_par_request(self, unit, addr, count):
+        """ build a get input registers request
+        
+        return -- the request message and the expected answer length
+        """
+        
         # update addr and count
         addr = addr*2 - 1
         count *= 2
         
-        ans = []
         command = 4
         answer_length = 3 + count * 2
         
         # build modbus request
-        msg = pack('>2B2H', unit, command, addr, count)
+        msg = GET_PAR_REQUEST.pack(unit, command, addr, count)
         
-        # wait for answer (do not check CRC)
-        replay = self.send(msg, answer_length)
+        return msg, answer_length
+    
+    def _get_par_answer(self, unit, replay, answer_length):
+        """ parse a get input registers answer
         
-        # if we have and answer, get the registers content
-        if replay and len(replay) == answer_length:
-            ans = unpack(">%df" % (count / 2), replay[3:])
+        return -- the registers content
+        """
         
-        return ans
+        self._check_answer(unit, 4, replay, answer_length)
+        
+        return float_struct((answer_length - 3) // 4).unpack_from(replay, 3)
     
-    def set_par(self, unit, addr, count, regs):
-        """ set input registers from in a modbus unit
-
-        unit -- modbus unit number
-        addr -- start addres [par addr = modbus addr / 2]
-        count -- number of registers to read [par count = modbus count / 2]
-        regs -- an array of data to write
+    def _get_raw_answer(self, unit, replay, answer_length):
+        """ check a get input registers answer
+        
+        return -- the registers content chars
+        """
+        
+        self._check_answer(unit, 4, replay, answer_length)
+        
+        return replay[3:]
+    
+    def _set_par_request(self, unit, addr, count, regs):
+        """ build a set input registers request
+        
+        return -- the request message and the expected answer length
         """
         
         # update addr and count
         addr = addr*2 - 1
         count *= 2
         
-        ans = [0, 0,]
         command = 0x10
         answer_length = 6
         
         # build modbus request
-        msg = pack('>2B2HB%df' % len(regs), unit, command, addr, 
+        msg = set_par_struct(len(regs)).pack(unit, command, addr, 
             count, count * 2, *regs)
         
-        # wait for answer (do not check CRC)
-        replay = self.send(msg, answer_length)
+        return msg, answer_length
+    
+    def _set_par_answer(self, unit, replay, answer_length):
+        """ parse a set input registers answer
+        
+        return -- the addr and number of registers
+        """
+        
+        self._check_answer(unit, 0x10, replay, answer_length)
+        
+        return SET_PAR_ANSWER.unpack_from(replay, 2)
+    
+    def _check_answer(self, unit, command, replay, answer_length):
+        """ check that an answer (without CRC) matches its request
+        
+        raise -- LTModbusTimeout when there is no answer, 
+            LTModbusExceptionResponse for a modbus exception answer and
+            LTModbusFrameError for a bad answer
+        """
+        
+        if not len(replay):
+            raise LTModbusTimeout("No answer from unit %d" % unit)
         
-        # if we have and answer, get the addr and number of registers
-        if len(replay) == answer_length:
-            ans = unpack(">2H", replay[2:])
+        if len(replay) < 3:
+            raise LTModbusFrameError("Short answer from unit %d" % unit)
         
-        return ans
+        replay_unit, function, value = ANSWER_HEADER.unpack_from(replay)
+        
+        if replay_unit != unit:
+            raise LTModbusFrameError("Answer from unit %d, expected unit %d" % (
+                replay_unit, unit))
+        
+        if function == command | 0x80:
+            raise LTModbusExceptionResponse(unit, command, value)
+        
+        if function != command:
+            raise LTModbusFrameError("Answer function %d, expected %d" % (
+                function, command))
+        
+        # the get input registers answer starts with the data length
+        if len(replay) != answer_length or (command == 4 and 
+                value != answer_length - 3):
+            raise LTModbusFrameError("Bad answer length from unit %d" % unit)
 
 class LTModbusSerial(Serial, LTModbus):
     """ a little modbus module using serial bus
+    
+    the input is drained only after a lost or corrupted answer, or when 
+    unexpected chars are waiting, unless always_flush is set. draining 
+    reads until the line is silent, so an answer that is still arriving 
+    is not taken as the answer of the next request.
     """
     
+    # max length of a RTU frame
+    max_frame_length = 256
+    
+    # min silence in seconds that ends an answer, USB serial adapters 
+    # may pause a frame for a few milliseconds
+    min_frame_gap = 0.02
+    
+    # flush input and output before every request
+    always_flush = False
+    
+    # late answers are drained before the next request
+    drops_late_answers = True
+    
     def __init__(self, *arguments, **keywords):
         # init the serial interface
         Serial.__init__(self, *arguments, **keywords)
         
-        # init the cache
-        self.ttl = 0
-        self.cache = {}
+        # silent interval in use and end time of the last frame
+        self.frame_gap = None
+        self.last_frame_time = 0
+        
+        # the last answer was lost or corrupted
+        self.resync = True
+    
+    def char_time(self):
+        """ get the time in seconds to send one char """
+        
+        bits = 1 + self.bytesize + (self.parity != 'N') + self.stopbits
+        
+        return float(bits) / self.baudrate
+    
+    def transfer_time(self, answer_length):
+        """ get the time in seconds needed to transfer an answer and its
+        2 crc chars
+        """
+        
+        return (answer_length + 2) * self.char_time()
+    
+    def silent_interval(self):
+        """ get the modbus 3.5 chars silent interval between frames """
+        
+        # above 19200 baud the silent interval is fixed to 1.75ms
+        if self.baudrate > 19200:
+            interval = 0.00175
+        else:
+            interval = 3.5 * self.char_time()
+        
+        return interval
+    
+    def set_timeout(self, timeout):
+        """ set the answer timeout in seconds """
+        
+        # changing the timeout reconfigures the port
+        if timeout != self.timeout:
+            self.timeout = timeout
+    
+    def bus(self):
+        """ get the serial port name """
+        
+        return self.port
     
     def swap_bytes(self, word_val):
         """ swap lsb and msb of a word """
@@ -133,16 +582,8 @@ class LTModbusSerial(Serial, LTModbus):
     
     def _calc_crc16(self, data):
         """ calculate 16 bit CRC of a datagram """
-        crc = 0xFFFF
-        for i in data:
-            crc = crc ^ ord(i)
-            for j in xrange(8):
-                tmp = crc & 1
-                crc = crc >> 1
-                if tmp:
-                    crc = crc ^ 0xA001
-
-        return pack('>H', self.swap_bytes(crc))
+        
+        return crc16_bytes(data)
     
     def send(self, msg, answer_length):
         """ send a message and wait for ans_length chars
@@ -153,63 +594,150 @@ class LTModbusSerial(Serial, LTModbus):
         return -- the answer chars
         """
         
-        # make sure no leftovers in buffers
-        self.flushInput()
-        self.flushOutput()
+        # a silence in the answer marks the end of the frame
+        gap = self.silent_interval()
+        if gap != self.frame_gap:
+            self._set_inter_byte_timeout(max(gap, self.min_frame_gap))
+            self.frame_gap = gap
+        
+        # make sure no leftovers in buffers, a late answer may still be 
+        # arriving, drain it until the line is silent
+        if self.resync or self._in_waiting():
+            self._drain(max(gap, self.min_frame_gap))
+            self.resync = False
+        
+        if self.always_flush:
+            self.flushInput()
+            self.flushOutput()
         
         # calc outgoing CRC
         msg = msg + self._calc_crc16(msg)
         
+        # keep the silent interval after the last frame
+        wait = self.last_frame_time + gap - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        
         # write data to unit
         self.write(msg)
         
-        # wait for answer and the 2 crc bytes(do not check CRC)
+        # wait for answer and the 2 crc bytes
         try:
-            replay = self.read(answer_length + 2)
+            replay = self._read_frame(answer_length + 2)
         except Exception:
-            replay = []
+            replay = b''
+        
+        self.last_frame_time = time.time()
+        
+        # a lost answer may still arrive, drain it before the next request
+        if len(replay) < 5:
+            self.resync = True
+            if not replay:
+                raise LTModbusTimeout("No answer from unit")
+            
+            # the shortest answer is an exception answer
+            raise LTModbusFrameError("Short answer from unit")
         
-        return replay[:-2]
+        try:
+            return check_crc(replay)
+        except LTModbusCRCError:
+            self.resync = True
+            raise
     
-    def get_par(self, unit, addr, count):
-        """ get input registers from a modbus unit
+    def _read_frame(self, frame_length):
+        """ read an answer frame
         
-        cached version of the get registers function
+        the frame ends after frame_length chars, after an exception 
+        answer or after a silent interval.
         
-        unit -- modbus unit number
-        addr -- start addres [par addr = modbus addr / 2]
-        count -- number of registers to read [par count = modbus count / 2]
+        return -- the frame chars
         """
         
-        # no cache
-        if self.ttl == 0:
-            return LTModbus.get_par(self, unit, addr, count)
+        # unit and function code
+        replay = self.read(2)
+        if len(replay) < 2:
+            return replay
         
-        # use cache
-        now = time.time()
-        key = "%d-%d-%d" % (unit, addr, count)
+        # exception answer: exception code and 2 crc chars
+        if bytearray(replay[1:2])[0] & 0x80:
+            frame_length = 5
+        
+        frame_length = min(frame_length, self.max_frame_length)
+        
+        return replay + self.read(frame_length - 2)
+    
+    def _drain(self, silence):
+        """ read and drop input until the line is silent for silence seconds
+        """
+        
+        end = time.time() + silence
+        while True:
+            waiting = self._in_waiting()
+            if waiting:
+                self.read(waiting)
+                end = time.time() + silence
+                continue
+            
+            wait = end - time.time()
+            if wait <= 0:
+                return
+            
+            time.sleep(min(wait, silence / 4))
+    
+    def _in_waiting(self):
+        """ get the number of received chars waiting to be read """
+        
+        # pyserial 3.x and 2.x names
         try:
-            # check key
-            values, last_update = self.cache[key]
-            if (now - last_update) > self.ttl:
-                raise AttributeError
-        except (KeyError, AttributeError):
-            # get fresh values
-            values = LTModbus.get_par(self, unit, addr, count)
-            self.cache[key] = (values, now)
+            return self.in_waiting
+        except AttributeError:
+            return self.inWaiting()
+    
+    def _set_inter_byte_timeout(self, timeout):
+        """ set the max silence between chars of one frame """
         
-        return values
+        # pyserial 3.x and 2.x names
+        if hasattr(self, 'inter_byte_timeout'):
+            self.inter_byte_timeout = timeout
+        else:
+            self.interCharTimeout = timeout
 
 class LTModbusTCP(LTModbus):
     """ a little modbus module using TCP/IP
+    
+    when window is more then one, get_pars and set_pars keep up to window
+    requests in flight and match the replies using the transaction id.
     """
     
-    def __init__(self, tcp_ip):
+    # receive buffer size, a MBAP frame is at most 260 chars
+    buffer_size = 4096
+    
+    # replies are matched to requests by the transaction id
+    drops_late_answers = True
+    
+    def __init__(self, tcp_ip, tcp_port=502, window=1, timeout=2):
         # defults modbus port
-        self.tcp_port = 502
+        self.tcp_port = tcp_port
+        
+        # connect and answer timeout in seconds
+        self.timeout = timeout
         
         # open socket
         self.ip = tcp_ip
+        
+        # max number of requests in flight
+        self.window = window
+        self.transaction_id = 0
+        
+        # send buffer, a MBAP frame is at most 260 chars
+        self.send_buffer = bytearray(260)
+        self.send_view = memoryview(self.send_buffer)
+        
+        # receive buffer, unread chars are buffer[start:end]
+        self.buffer = bytearray(self.buffer_size)
+        self.buffer_view = memoryview(self.buffer)
+        self.buffer_start = 0
+        self.buffer_end = 0
     
     def open(self):
         """ open socket """
@@ -217,16 +745,49 @@ class LTModbusTCP(LTModbus):
         # open socket
         try:
             self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.soc.settimeout(2)
+            self.soc.settimeout(self.timeout)
             self.soc.connect((self.ip, self.tcp_port))
+            
+            # send pipelined requests without waiting for acks
+            self.soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except socket.error:
             raise Exception("Can't connect to unit")
         
+        # drop leftovers of older connections
+        self.buffer_start = 0
+        self.buffer_end = 0
+        
     def close(self):
         """ open socket """
         
         self.soc.close()
+    
+    def is_open(self):
+        """ check that the socket is still connected
         
+        an idle socket that is readable was closed by the unit or holds
+        unexpected chars, both mean it should not be used.
+        """
+        
+        try:
+            readable, writable, errors = select.select([self.soc], [], [], 0)
+        except (socket.error, ValueError):
+            return False
+        
+        return not readable
+    
+    def set_timeout(self, timeout):
+        """ set the answer timeout in seconds """
+        
+        if timeout != self.timeout:
+            self.timeout = timeout
+            self.soc.settimeout(timeout)
+    
+    def bus(self):
+        """ get the gateway address """
+        
+        return (self.ip, self.tcp_port)
+    
     def send(self, msg, answer_length):
         """ send a message and wait for ans_length chars
         
@@ -236,11 +797,281 @@ class LTModbusTCP(LTModbus):
         return -- the answer chars
         """
         
-        # send data using tcp
-        message = pack(">3H", 1, 0, len(msg)) + msg
+        transaction_id = self._send_frame(msg)
         
-        self.soc.send(message)
-        replay = self.soc.recv(answer_length + 6)
+        # skip stale replies of older transactions
+        while True:
+            replay_id, replay = self._recv_frame()
+            if replay_id == transaction_id:
+                return replay
+    
+    def send_many(self, msgs):
+        """ send messages using up to window requests in flight
         
-        return replay[6:]
-
+        msgs -- a list of (msg, answer_length) tupples
+        
+        return -- a list of answer chars, one for each message
+        """
+        
+        return self._send_many(msgs)[0]
+    
+    def _send_many(self, msgs):
+        """ send messages using up to window requests in flight
+        
+        return -- a list of answer chars and a list of response times in 
+            seconds, one for each message
+        """
+        
+        replays = [[]] * len(msgs)
+        latencies = [None] * len(msgs)
+        pending = {}
+        i = 0
+        
+        while i < len(msgs) or pending:
+            # fill the window
+            while i < len(msgs) and len(pending) < self.window:
+                transaction_id = self._send_frame(msgs[i][0])
+                pending[transaction_id] = (i, time.time())
+                i += 1
+            
+            # match the reply to its request
+            replay_id, replay = self._recv_frame()
+            if replay_id in pending:
+                n, sent = pending.pop(replay_id)
+                replays[n] = replay
+                latencies[n] = time.time() - sent
+        
+        return replays, latencies
+    
+    def get_pars(self, requests):
+        """ get input registers from several blocks
+        
+        with a retry policy, requests that failed in the window are
+        retried one at a time, and requests of skipped units fail without 
+        waiting for the window.
+        
+        requests -- a list of (unit, addr, count) tupples
+        
+        return -- a list of answers, one for each request
+        """
+        
+        answers = [None] * len(requests)
+        
+        # use cache
+        if self.cache is not None:
+            for i, (unit, addr, count) in enumerate(requests):
+                answers[i] = self.cache.get((self.bus(), unit), addr, count)
+                
+                if self.hooks is not None:
+                    self.hooks.event(answers[i] is None and 'cache_miss' or 
+                        'cache_hit', unit)
+        
+        misses = [i for i, values in enumerate(answers) if values is None]
+        msgs = [self._get_par_request(*requests[i]) for i in misses]
+        
+        parsed = self._parse_many([requests[i][0] for i in misses], msgs, 
+            self._get_par_answer)
+        
+        for i, answer in zip(misses, parsed):
+            # retry one request at a time
+            if answer is None or isinstance(answer, LTModbusError):
+                answers[i] = LTModbus.get_par(self, *requests[i])
+                continue
+            
+            answers[i] = answer
+            if self.cache is not None:
+                unit, addr, count = requests[i]
+                self.cache.put((self.bus(), unit), addr, count, answers[i])
+        
+        return answers
+    
+    def set_pars(self, requests):
+        """ set input registers of several blocks
+        
+        requests -- a list of (unit, addr, count, regs) tupples
+        
+        return -- a list of answers, one for each request
+        """
+        
+        # drop cached answers of the written pars
+        for unit, addr, count, regs in requests:
+            self.invalidate(unit, addr, count)
+        
+        msgs = [self._set_par_request(unit, addr, count, regs) 
+            for unit, addr, count, regs in requests]
+        
+        # writes are not retried
+        answers = self._parse_many([request[0] for request in requests], 
+            msgs, self._set_par_answer)
+        
+        for n, answer in enumerate(answers):
+            # not sent, the unit is skipped by the retry policy
+            if answer is None:
+                answers[n] = LTModbus.set_par(self, *requests[n])
+            elif isinstance(answer, LTModbusError):
+                raise answer
+        
+        return answers
+    
+    def _parse_many(self, units, msgs, parse):
+        """ send messages using send_many and parse the answers
+        
+        with a retry policy, messages of dead units are not sent, the 
+        window uses the longest answer timeout of its units, and the 
+        response times of the answers are recorded.
+        
+        units -- the unit of each message
+        msgs -- a list of (msg, answer_length) tupples
+        parse -- a function of (unit, replay, answer_length)
+        
+        return -- a list of parsed answers, with a retry policy failed 
+            answers are the LTModbusError to retry, and answers of messages
+            that were not sent are None
+        """
+        
+        hooks = self.hooks
+        retry = self.retry
+        
+        answers = [None] * len(msgs)
+        sent = list(range(len(msgs)))
+        
+        if retry is not None:
+            sent = [n for n in sent if not retry.is_dead(units[n])]
+            if not sent:
+                return answers
+            
+            self.set_timeout(max([retry.timeout(units[n]) for n in sent]))
+        
+        if hooks is not None:
+            tokens = dict([(n, hooks.before(units[n], 
+                bytearray(msgs[n][0][1:2])[0])) for n in sent])
+        
+        try:
+            replays, latencies = self._send_many([msgs[n] for n in sent])
+            error = None
+        except LTModbusError as e:
+            replays = latencies = [None] * len(sent)
+            error = e
+        
+        for n, replay, latency in zip(sent, replays, latencies):
+            unit = units[n]
+            msg, answer_length = msgs[n]
+            
+            def request():
+                if replay is None:
+                    raise error
+                return parse(unit, replay, answer_length)
+            
+            if hooks is not None:
+                request = self._hooked(unit, msg, answer_length, request, 
+                    tokens[n])
+            
+            try:
+                answers[n] = request()
+            except LTModbusError as e:
+                if retry is None:
+                    raise
+                answers[n] = e
+                continue
+            
+            if retry is not None:
+                retry.record(unit, latency)
+        
+        return answers
+    
+    def _send_frame(self, msg):
+        """ send a message with a new MBAP header
+        
+        return -- the transaction id of the message
+        """
+        
+        # transaction ids are 1 .. 0xffff
+        self.transaction_id = self.transaction_id % 0xffff + 1
+        
+        # build the frame in the send buffer
+        length = len(msg)
+        MBAP_HEADER.pack_into(self.send_buffer, 0, 
+            self.transaction_id, 0, length)
+        self.send_buffer[6:6 + length] = msg
+        
+        try:
+            self.soc.sendall(self.send_view[:6 + length])
+        except socket.error:
+            self._reconnect()
+            raise LTModbusConnectionError("Connection to unit lost")
+        
+        return self.transaction_id
+    
+    def _recv_frame(self):
+        """ wait for a reply frame
+        
+        return -- the transaction id and the answer chars
+        """
+        
+        try:
+            # MBAP header: transaction id, protocol id, length and unit id
+            self._recv_fill(7)
+            transaction_id, protocol, length = MBAP_HEADER.unpack_from(
+                self.buffer, self.buffer_start)
+            
+            if protocol != 0 or not 2 <= length <= MAX_MBAP_LENGTH:
+                raise LTModbusFrameError("Bad MBAP header")
+            
+            # the length counts the unit id and the modbus message
+            self._recv_fill(6 + length)
+        except socket.timeout:
+            # the rest of a partly read frame may still arrive, the frame 
+            # boundaries are lost until we reconnect
+            if self.buffer_end > self.buffer_start:
+                self._reconnect()
+            raise LTModbusTimeout("No answer from unit")
+        except (LTModbusFrameError, LTModbusConnectionError):
+            self._reconnect()
+            raise
+        except socket.error:
+            self._reconnect()
+            raise LTModbusConnectionError("Connection to unit lost")
+        
+        start = self.buffer_start + 6
+        end = start + length
+        replay = self.buffer_view[start:end].tobytes()
+        
+        # rewind an empty buffer
+        if end == self.buffer_end:
+            self.buffer_start = self.buffer_end = 0
+        else:
+            self.buffer_start = end
+        
+        return transaction_id, replay
+    
+    def _reconnect(self):
+        """ open the socket again, dropping all chars in flight """
+        
+        self.soc.close()
+        
+        # a failed connect leaves the socket closed, the next request fails
+        try:
+            self.open()
+        except Exception:
+            pass
+    
+    def _recv_fill(self, length):
+        """ make sure the receive buffer holds at least length unread chars 
+        
+        chars that arrive after the current frame stay in the buffer for 
+        the next call.
+        """
+        
+        while self.buffer_end - self.buffer_start < length:
+            # move unread chars to the start of the buffer
+            if self.buffer_start + length > len(self.buffer):
+                unread = self.buffer_end - self.buffer_start
+                self.buffer[:unread] = self.buffer[
+                    self.buffer_start:self.buffer_end]
+                self.buffer_start = 0
+                self.buffer_end = unread
+            
+            n = self.soc.recv_into(self.buffer_view[self.buffer_end:])
+            if not n:
+                raise LTModbusConnectionError("Connection closed by unit")
+            self.buffer_end += n
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_async.py
+
+asyncio versions of the little modbus TCP and serial modules
+
+this module needs python 3.5 or newer, the serial module needs the
+pyserial-asyncio package.
+
+usage:
+    async def poll(ip):
+        soc = AsyncLTModbusTCP(ip)
+        await soc.open()
+        try:
+            return await soc.get_par(31, 5951, 18)
+        finally:
+            await soc.close()
+    
+    loop.run_until_complete(asyncio.gather(*[poll(ip) for ip in ips]))
+"""
+
+import asyncio
+
+from ltmodbus import LTModbus, MBAP_HEADER, MAX_MBAP_LENGTH, MAX_READ_GAP
+from ltmodbus import plan_reads, scatter_reads, check_crc
+from ltmodbus import LTModbusTimeout, LTModbusFrameError
+from ltmodbus import LTModbusConnectionError
+from ltmodbus_crc import crc16_bytes
+
+try:
+    from serial_asyncio import open_serial_connection
+except ImportError:
+    # no serial comunication
+    pass
+
+class AsyncLTModbus(LTModbus):
+    """ interface for an asyncio little modbus module
+    
+    same parameters as LTModbus, get_par and set_par are coroutines.
+    """
+    
+    async def send(self, msg, answer_length):
+        """ send a message and wait for ans_length chars
+        
+        msg -- the messeg to send
+        answer_length -- wait for ans_length chars
+        
+        return -- the answer chars
+        """
+        
+        raise Exception("AsyncLTModbus::send - Not implementd")
+    
+    async def get_par(self, unit, addr, count):
+        """ get input registers from a modbus unit
+        
+        unit -- modbus unit number
+        addr -- start addres [par addr = modbus addr / 2]
+        count -- number of registers to read [par count = modbus count / 2]
+        """
+        
+        msg, answer_length = self._get_par_request(unit, addr, count)
+        replay = await self.send(msg, answer_length)
+        
+        return self._get_par_answer(unit, replay, answer_length)
+    
+    async def set_par(self, unit, addr, count, regs):
+        """ set input registers from in a modbus unit
+        
+        unit -- modbus unit number
+        addr -- start addres [par addr = modbus addr / 2]
+        count -- number of registers to read [par count = modbus count / 2]
+        regs -- an array of data to write
+        """
+        
+        msg, answer_length = self._set_par_request(unit, addr, count, regs)
+        replay = await self.send(msg, answer_length)
+        
+        return self._set_par_answer(unit, replay, answer_length)
+    
+    async def get_pars(self, requests):
+        """ get input registers from several blocks
+        
+        requests -- a list of (unit, addr, count) tupples
+        
+        return -- a list of answers, one for each request
+        """
+        
+        return await asyncio.gather(*[self.get_par(unit, addr, count)
+            for unit, addr, count in requests])
+    
+    async def set_pars(self, requests):
+        """ set input registers of several blocks
+        
+        requests -- a list of (unit, addr, count, regs) tupples
+        
+        return -- a list of answers, one for each request
+        """
+        
+        return await asyncio.gather(*[self.set_par(unit, addr, count, regs)
+            for unit, addr, count, regs in requests])
+    
+    async def read_many(self, unit, addrs, max_gap=MAX_READ_GAP):
+        """ get paramters from a list of scattered addresses
+        
+        see LTModbus.read_many
+        """
+        
+        spans = plan_reads(addrs, max_gap)
+        answers = await self.get_pars([(unit, addr, count)
+            for addr, count in spans])
+        
+        return scatter_reads(addrs, spans, answers)
+
+class AsyncLTModbusSerial(AsyncLTModbus):
+    """ an asyncio little modbus module using serial bus
+    
+    requests on the bus are sent one at a time, after the modbus silent
+    interval. after a lost or corrupted answer the input is drained until
+    the bus is silent, a late answer is not taken as the answer of the
+    next request.
+    """
+    
+    # min silence in seconds that ends a late answer, USB serial adapters 
+    # may pause a frame for a few milliseconds
+    min_frame_gap = 0.02
+    
+    def __init__(self, port, baudrate=4800, bytesize=8, parity='E',
+            stopbits=1, timeout=1.5):
+        self.port = port
+        self.baudrate = baudrate
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.timeout = timeout
+        
+        self.reader = None
+        self.writer = None
+        self.lock = None
+        
+        # end time of the last frame, and the last answer was lost or 
+        # corrupted
+        self.last_frame_time = 0
+        self.resync = True
+    
+    async def open(self):
+        """ open serial port """
+        
+        self.reader, self.writer = await open_serial_connection(
+            url=self.port, baudrate=self.baudrate, bytesize=self.bytesize,
+            parity=self.parity, stopbits=self.stopbits)
+        self.lock = asyncio.Lock()
+    
+    async def close(self):
+        """ close serial port """
+        
+        self.writer.close()
+    
+    def char_time(self):
+        """ get the time in seconds to send one char """
+        
+        bits = 1 + self.bytesize + (self.parity != 'N') + self.stopbits
+        
+        return float(bits) / self.baudrate
+    
+    def silent_interval(self):
+        """ get the modbus 3.5 chars silent interval between frames """
+        
+        # above 19200 baud the silent interval is fixed to 1.75ms
+        if self.baudrate > 19200:
+            interval = 0.00175
+        else:
+            interval = 3.5 * self.char_time()
+        
+        return interval
+    
+    async def send(self, msg, answer_length):
+        """ send a message and wait for ans_length chars
+        
+        msg -- the messeg to send
+        answer_length -- wait for ans_length chars
+        
+        return -- the answer chars
+        """
+        
+        loop = asyncio.get_event_loop()
+        gap = self.silent_interval()
+        
+        async with self.lock:
+            # a lost answer may still arrive, drain it before the request
+            if self.resync:
+                await self._drain(max(gap, self.min_frame_gap))
+                self.resync = False
+            
+            # keep the silent interval after the last frame
+            wait = self.last_frame_time + gap - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            
+            # calc outgoing CRC
+            self.writer.write(msg + crc16_bytes(msg))
+            
+            # wait for answer and the 2 crc bytes, an exception answer
+            # is known by the function code
+            try:
+                header = await asyncio.wait_for(
+                    self.reader.readexactly(2), self.timeout)
+                if header[1] & 0x80:
+                    answer_length = 3
+                replay = header + await asyncio.wait_for(
+                    self.reader.readexactly(answer_length), self.timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                self.resync = True
+                raise LTModbusTimeout("No answer from unit")
+            finally:
+                self.last_frame_time = loop.time()
+            
+            try:
+                return check_crc(replay)
+            except LTModbusFrameError:
+                self.resync = True
+                raise
+    
+    async def _drain(self, silence):
+        """ read and drop input until the bus is silent for silence seconds
+        """
+        
+        while True:
+            try:
+                chars = await asyncio.wait_for(self.reader.read(256), silence)
+            except asyncio.TimeoutError:
+                return
+            
+            # end of stream
+            if not chars:
+                return
+
+class AsyncLTModbusTCP(AsyncLTModbus):
+    """ an asyncio little modbus module using TCP/IP
+    
+    concurrent requests on one connection are sent with their own
+    transaction id, up to window requests are in flight.
+    """
+    
+    def __init__(self, tcp_ip, tcp_port=502, window=1, timeout=2):
+        self.ip = tcp_ip
+        self.tcp_port = tcp_port
+        self.timeout = timeout
+        
+        # max number of requests in flight
+        self.window = window
+        self.transaction_id = 0
+        self.pending = {}
+        
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.in_flight = None
+    
+    async def open(self):
+        """ open socket """
+        
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.tcp_port), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            raise Exception("Can't connect to unit")
+        
+        self.in_flight = asyncio.Semaphore(self.window)
+        self.reader_task = asyncio.ensure_future(self._read_frames())
+    
+    async def close(self):
+        """ close socket """
+        
+        if self.reader_task:
+            self.reader_task.cancel()
+        
+        self.writer.close()
+    
+    async def send(self, msg, answer_length):
+        """ send a message and wait for ans_length chars
+        
+        msg -- the messeg to send
+        answer_length -- wait for ans_length chars
+        
+        return -- the answer chars
+        """
+        
+        async with self.in_flight:
+            # transaction ids are 1 .. 0xffff
+            self.transaction_id = self.transaction_id % 0xffff + 1
+            transaction_id = self.transaction_id
+            
+            replay = asyncio.get_event_loop().create_future()
+            self.pending[transaction_id] = replay
+            
+            self.writer.write(
+                MBAP_HEADER.pack(transaction_id, 0, len(msg)) + msg)
+            
+            try:
+                return await asyncio.wait_for(replay, self.timeout)
+            except asyncio.TimeoutError:
+                raise LTModbusTimeout("No answer from unit")
+            finally:
+                self.pending.pop(transaction_id, None)
+    
+    async def _read_frames(self):
+        """ read reply frames and pass them to the waiting requests """
+        
+        try:
+            while True:
+                # MBAP header: transaction id, protocol id, length
+                header = await self.reader.readexactly(6)
+                transaction_id, protocol, length = MBAP_HEADER.unpack(header)
+                if protocol != 0 or not 2 <= length <= MAX_MBAP_LENGTH:
+                    raise LTModbusFrameError("Bad MBAP header")
+                
+                replay = await self.reader.readexactly(length)
+                
+                # replies of timed out requests are dropped
+                waiter = self.pending.get(transaction_id)
+                if waiter and not waiter.done():
+                    waiter.set_result(replay)
+        except asyncio.IncompleteReadError:
+            error = LTModbusConnectionError("Connection closed by unit")
+        except OSError:
+            error = LTModbusConnectionError("Connection to unit lost")
+        except LTModbusFrameError as e:
+            error = e
+        
+        for waiter in self.pending.values():
+            if not waiter.done():
+                waiter.set_exception(error)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_bench.py
+
+Throughput benchmarks against simulated units
+
+measures for each transport:
+    get_par and set_par transactions per second
+    LTModbusLogger.read_data frames per second
+the CPU time of the CRC and the float codec per frame, and the frames
+per second of the csv and sqlite sinks through dump_line.
+
+serial transports are measured at several baudrates, TCP/IP transports
+at several simulated round trip times. results are written as JSON.
+
+usage:
+    ltmodbus_bench.py -d 2 -b 9600,115200 -l 0,0.005 -o bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import timeit
+import platform
+import argparse
+import tempfile
+
+from ltmodbus import LTModbusSerial, LTModbusTCP, float_struct, check_crc
+from ltmodbus_crc import crc16, crc16_bytes
+from ltmodbus_logger import LTModbusLogger, dump_line
+from ltmodbus_sim import SimLogger, RTUSlave, TCPServer
+from ltmodbus_sink import SQLiteSink
+
+# the benchmarked unit
+UNIT = 31
+
+def rate(function, duration):
+    """ call a function again and again for duration seconds
+    
+    return -- calls per second
+    """
+    
+    n = 0
+    start = time.time()
+    end = start + duration
+    
+    while True:
+        function()
+        n += 1
+        
+        now = time.time()
+        if now >= end:
+            return n / (now - start)
+
+def bench_transport(soc, duration):
+    """ measure a transport connected to a simulated logger
+    
+    return -- a dict of results
+    """
+    
+    ser = LTModbusLogger(soc)
+    ser.unit = UNIT
+    
+    results = {
+        'get_par': rate(lambda: soc.get_par(UNIT, 5941, 28), duration),
+        'set_par': rate(lambda: soc.set_par(UNIT, 5941, 6,
+            [1, 1, 2013, 0, 0, 0]), duration),
+        'read_data': rate(ser.read_data, duration)}
+    
+    ser.block_read = False
+    results['read_data_no_block_read'] = rate(ser.read_data, duration)
+    
+    return results
+
+def bench_serial(baudrate, duration):
+    """ measure LTModbusSerial on a simulated pty unit
+    
+    return -- a dict of results
+    """
+    
+    slave = RTUSlave([SimLogger(UNIT)], baudrate=baudrate)
+    slave.start()
+    
+    soc = LTModbusSerial(port=slave.port, baudrate=baudrate, timeout=1)
+    try:
+        results = bench_transport(soc, duration)
+        
+        soc.always_flush = True
+        results['get_par_always_flush'] = rate(
+            lambda: soc.get_par(UNIT, 5941, 28), duration)
+    finally:
+        soc.close()
+    
+    results['baudrate'] = baudrate
+    
+    return results
+
+def bench_tcp(latency, duration, window=4):
+    """ measure LTModbusTCP on a simulated TCP/IP unit
+    
+    latency -- simulated round trip time in seconds
+    
+    return -- a dict of results
+    """
+    
+    server = TCPServer([SimLogger(UNIT)], latency=latency)
+    server.start()
+    
+    soc = LTModbusTCP(server.ip, server.tcp_port, window=window)
+    soc.open()
+    try:
+        results = bench_transport(soc, duration)
+        
+        # pipelined requests, frames per second of window requests
+        requests = [(UNIT, 5941, 28)] * window
+        results['get_pars_window'] = window * rate(
+            lambda: soc.get_pars(requests), duration)
+    finally:
+        soc.close()
+    
+    results['latency'] = latency
+    
+    return results
+
+def bench_cpu(number=10000):
+    """ measure the CPU time of one frame in the CRC and codec functions
+    
+    return -- a dict of microseconds per frame
+    """
+    
+    # a get_par answer of pars 5941 ... 5968
+    logger = SimLogger(UNIT)
+    values = logger.get_pars(5941, 28)
+    answer = b'\x1f\x04\x70' + float_struct(28).pack(*values)
+    frame = answer + crc16_bytes(answer)
+    
+    functions = {
+        'crc16': lambda: crc16(frame),
+        'check_crc': lambda: check_crc(frame),
+        'decode': lambda: float_struct(28).unpack_from(answer, 3),
+        'encode': lambda: float_struct(28).pack(*values)}
+    
+    return dict([(name, 1e6 * timeit.timeit(function, number=number) / number)
+        for name, function in functions.items()])
+
+def bench_sinks(number=10000):
+    """ measure the csv and sqlite sinks through dump_line
+    
+    return -- a dict of frames per second
+    """
+    
+    logger = SimLogger(UNIT, start=0)
+    frames = [(t,) + tuple(logger.frame(t))
+        for t in range(0, number * 60, 60)]
+    
+    directory = tempfile.mkdtemp()
+    stdout = sys.stdout
+    results = {}
+    
+    try:
+        # dump_line also prints the frames
+        sys.stdout = open(os.devnull, 'w')
+        
+        for name in ('csv', 'sqlite'):
+            filename = os.path.join(directory, 'bench.' + name)
+            
+            t = time.time()
+            if name == 'csv':
+                f, c = open(filename, 'wb'), None
+            else:
+                f, c = None, SQLiteSink(filename)
+            
+            for frame in frames:
+                dump_line(f, c, frame)
+            
+            (f or c).close()
+            results[name] = number / (time.time() - t)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(directory)
+    
+    return results
+
+def main():
+    """ get user arguments and run the benchmarks
+    """
+    
+    # command line parser
+    parser = argparse.ArgumentParser(
+        description='LT-Modbus throughput benchmarks.')
+    
+    parser.add_argument('-d', dest='duration',
+                       type=float, default=1.0,
+                       help='seconds for each measurement (default: 1)')
+    parser.add_argument('-b', dest='baudrates',
+                       type=str, default='9600,19200,115200',
+                       help='serial baudrates (default: 9600,19200,115200)')
+    parser.add_argument('-l', dest='latencies',
+                       type=str, default='0,0.001,0.005',
+                       help='TCP/IP round trip times (default: 0,0.001,0.005)')
+    parser.add_argument('-o', dest='filename',
+                       type=str, default='',
+                       help='JSON results file (default: stdout)')
+    
+    args = parser.parse_args()
+    
+    results = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu': bench_cpu(),
+        'sinks': bench_sinks(),
+        'serial': [bench_serial(int(baudrate), args.duration)
+            for baudrate in args.baudrates.split(',')],
+        'tcp': [bench_tcp(float(latency), args.duration)
+            for latency in args.latencies.split(',')]}
+    
+    text = json.dumps(results, indent=2, sort_keys=True)
+    
+    if args.filename:
+        with open(args.filename, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_cache.py
+
+A register cache for little modbus modules
+
+usage:
+    soc.cache = RegisterCache(max_entries=256, ttl=1.0)
+
+one cache can be shared by several serial and TCP/IP modules, the modules
+key their answers by (bus, unit), so the same unit number on two buses
+does not share answers.
+"""
+
+import time
+import threading
+
+from collections import OrderedDict
+
+class RegisterCache():
+    """ a bounded cache of get_par answers
+    
+    entries are keyed by (unit, addr, count), live ttl seconds and the
+    least recently used entry is evicted when the cache is full. unit is
+    any hashable unit key, little modbus modules use (bus, unit number).
+    
+    a request that is contained in a fresh cached entry of the same unit 
+    is answered from that entry, e.g. a cached answer for pars 5941..5968 
+    also answers a request for pars 5951..5968.
+    """
+    
+    def __init__(self, max_entries=1024, ttl=1.0):
+        """ create a register cache
+        
+        max_entries -- max number of cached answers
+        ttl -- seconds an answer stays fresh
+        """
+        
+        self.max_entries = max_entries
+        self.ttl = ttl
+        
+        # (unit, addr, count) -> (values, expire time), oldest use first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        
+        # unit -> set of cached (addr, count) spans
+        self.spans = {}
+        
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, unit, addr, count):
+        """ get a fresh cached answer
+        
+        return -- the cached values or None
+        """
+        
+        now = time.time()
+        
+        with self.lock:
+            key = self._find(unit, addr, count, now)
+            if key is None:
+                self.misses += 1
+                return None
+            
+            # mark as recently used
+            values, expire = self.entries.pop(key)
+            self.entries[key] = (values, expire)
+            self.hits += 1
+        
+        # get the requested part of the span
+        start = addr - key[1]
+        if start == 0 and count == key[2]:
+            return values
+        
+        return tuple(values[start:start + count])
+    
+    def put(self, unit, addr, count, values, ttl=None):
+        """ cache an answer
+        
+        ttl -- seconds this answer stays fresh, None for the cache ttl
+        """
+        
+        if ttl is None:
+            ttl = self.ttl
+        
+        key = (unit, addr, count)
+        
+        with self.lock:
+            # drop older spans that overlap the new answer
+            spans = self.spans.setdefault(unit, set())
+            for span_addr, span_count in list(spans):
+                if span_addr < addr + count and addr < span_addr + span_count:
+                    self._remove((unit, span_addr, span_count))
+            
+            self.entries[key] = (values, time.time() + ttl)
+            spans.add((addr, count))
+            
+            # evict least recently used entries
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+    
+    def invalidate(self, unit, addr=None, count=None):
+        """ drop cached answers of a unit
+        
+        unit -- modbus unit number
+        addr, count -- drop only answers that overlap these pars, 
+            None for all the answers of the unit
+        """
+        
+        with self.lock:
+            for span_addr, span_count in list(self.spans.get(unit, ())):
+                if (addr is None or (span_addr < addr + count and 
+                        addr < span_addr + span_count)):
+                    self._remove((unit, span_addr, span_count))
+    
+    def clear(self):
+        """ drop all cached answers """
+        
+        with self.lock:
+            self.entries.clear()
+            self.spans.clear()
+    
+    def _find(self, unit, addr, count, now):
+        """ find a fresh entry containing the pars, the lock must be held 
+        
+        return -- the entry key or None
+        """
+        
+        key = (unit, addr, count)
+        if key in self.entries and now <= self.entries[key][1]:
+            return key
+        
+        for span_addr, span_count in self.spans.get(unit, ()):
+            if span_addr <= addr and addr + count <= span_addr + span_count:
+                key = (unit, span_addr, span_count)
+                if now <= self.entries[key][1]:
+                    return key
+        
+        return None
+    
+    def _remove(self, key):
+        """ remove an entry, the lock must be held """
+        
+        del self.entries[key]
+        self.spans[key[0]].discard(key[1:])
+    
+    def stats(self):
+        """ return a dict of cache statistics """
+        
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions}
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_crc.py
+
+A table driven modbus CRC-16 engine
+
+running this module as a script runs a micro-benchmark comparing the
+table driven engine with the bit-by-bit implementation.
+"""
+
+import os
+import timeit
+
+from struct import Struct
+
+# modbus CRC-16 (reflected 0x8005 polynom)
+CRC16_POLY = 0xA001
+CRC16_INIT = 0xFFFF
+
+# the CRC is sent lsb first
+CRC16_STRUCT = Struct('<H')
+
+def _make_table(poly):
+    """ build a 256 entries lookup table for a reflected 16 bit polynom """
+    table = []
+    for i in range(256):
+        crc = i
+        for j in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ poly
+            else:
+                crc = crc >> 1
+        table.append(crc)
+    
+    return tuple(table)
+
+CRC16_TABLE = _make_table(CRC16_POLY)
+
+def crc16_update(crc, data):
+    """ update a running CRC with more data
+    
+    crc -- the current CRC value
+    data -- a string, bytes or bytearray to add
+    
+    return -- the updated CRC value
+    """
+    
+    table = CRC16_TABLE
+    for b in bytearray(data):
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    
+    return crc
+
+def crc16(data):
+    """ calculate the 16 bit CRC value of a datagram """
+    
+    return crc16_update(CRC16_INIT, data)
+
+def crc16_bytes(data):
+    """ calculate the 16 bit CRC of a datagram, packed as sent on the wire """
+    
+    return CRC16_STRUCT.pack(crc16_update(CRC16_INIT, data))
+
+def crc16_bitwise(data):
+    """ calculate the 16 bit CRC value of a datagram bit by bit
+    
+    this is the reference implementation the table driven engine replaced,
+    kept for testing and benchmarking.
+    """
+    
+    crc = CRC16_INIT
+    for b in bytearray(data):
+        crc = crc ^ b
+        for j in range(8):
+            tmp = crc & 1
+            crc = crc >> 1
+            if tmp:
+                crc = crc ^ CRC16_POLY
+    
+    return crc
+
+class CRC16():
+    """ an incremental modbus CRC-16 calculator
+    
+    usage:
+        crc = CRC16()
+        crc.update(header)
+        crc.update(payload)
+        crc.digest()
+    """
+    
+    def __init__(self, data=None):
+        self.crc = CRC16_INIT
+        
+        if data:
+            self.update(data)
+    
+    def update(self, data):
+        """ add data to the running CRC """
+        
+        self.crc = crc16_update(self.crc, data)
+        return self
+    
+    def digest(self):
+        """ return the CRC packed as sent on the wire (lsb first) """
+        
+        return CRC16_STRUCT.pack(self.crc)
+    
+    def reset(self):
+        """ start a new CRC calculation """
+        
+        self.crc = CRC16_INIT
+
+def benchmark(sizes=(8, 61, 255), number=2000):
+    """ compare the table driven and the bit by bit implementations
+    
+    sizes -- datagram sizes to test
+    number -- number of CRC calculations per test
+    
+    return -- a list of (size, bitwise seconds, table seconds) tupples
+    """
+    
+    results = []
+    for size in sizes:
+        data = os.urandom(size)
+        
+        # make sure both implementations agree
+        if crc16(data) != crc16_bitwise(data):
+            raise Exception("CRC16 mismatch on %d bytes" % size)
+        
+        bitwise = min(timeit.repeat(lambda: crc16_bitwise(data),
+            number=number, repeat=3))
+        table = min(timeit.repeat(lambda: crc16(data),
+            number=number, repeat=3))
+        
+        results.append((size, bitwise, table))
+    
+    return results
+
+if __name__ == '__main__':
+    number = 2000
+    
+    print("bytes, bitwise [us], table [us], speedup")
+    for size, bitwise, table in benchmark(number=number):
+        print("%d, %.2f, %.2f, %.1fx" % (size,
+            1e6 * bitwise / number, 1e6 * table / number, bitwise / table))
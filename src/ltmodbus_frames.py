@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_frames.py
+
+A preallocated buffer of data log frames
+
+frames are kept as numpy arrays when numpy is installed, and as
+array('f') otherwise.
+
+usage:
+    frames = FrameBuffer(24 * 60)
+    ser.read_frames_into(frames, start, end)
+    timestamps, data = frames.view()
+"""
+
+import sys
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    # no numpy, use array
+    numpy = None
+
+class FrameBuffer():
+    """ a ring of data log frames
+    
+    when full, new frames overwrite the oldest frames.
+    """
+    
+    def __init__(self, capacity, width=18):
+        """ allocate the buffer
+        
+        capacity -- max number of frames
+        width -- number of data paramters in a frame
+        """
+        
+        self.capacity = capacity
+        self.width = width
+        
+        # number of frames and the index of the next frame
+        self.size = 0
+        self.next = 0
+        
+        if numpy is not None:
+            self.timestamps = numpy.zeros(capacity, dtype='i8')
+            self.data = numpy.zeros((capacity, width), dtype='>f4')
+        else:
+            self.timestamps = array('d', [0]) * capacity
+            self.data = array('f', [0]) * (capacity * width)
+    
+    def append(self, timestamp, data):
+        """ add a frame
+        
+        timestamp -- the frame timestamp
+        data -- 4 big endian chars for each data paramter
+        """
+        
+        i = self.next
+        
+        self.timestamps[i] = timestamp
+        if numpy is not None:
+            self.data[i] = numpy.frombuffer(data, dtype='>f4')
+        else:
+            self.data[i * self.width:(i + 1) * self.width] = _float_array(data)
+        
+        self.next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+    
+    def view(self):
+        """ get the frames, oldest first
+        
+        the arrays are views of the buffer, unless the ring wrapped around
+        in which case they are ordered copies (python 2 arrays are always
+        copied).
+        
+        return -- (timestamps, data), numpy arrays of shape (size, ) and
+            (size, width), or arrays of size and size * width items
+        """
+        
+        if self.size < self.capacity or self.next == 0:
+            if numpy is not None:
+                return self.timestamps[:self.size], self.data[:self.size]
+            
+            try:
+                return (memoryview(self.timestamps)[:self.size],
+                    memoryview(self.data)[:self.size * self.width])
+            except TypeError:
+                # python 2 arrays have no memoryview, return copies
+                return (self.timestamps[:self.size],
+                    self.data[:self.size * self.width])
+        
+        # the ring wrapped, oldest frame is the next one to be written
+        i = self.next
+        if numpy is not None:
+            return (numpy.concatenate((self.timestamps[i:], self.timestamps[:i])),
+                numpy.concatenate((self.data[i:], self.data[:i])))
+        
+        w = self.width
+        return (self.timestamps[i:] + self.timestamps[:i],
+            self.data[i * w:] + self.data[:i * w])
+    
+    def clear(self):
+        """ drop all frames """
+        
+        self.size = 0
+        self.next = 0
+
+def _float_array(data):
+    """ convert big endian float chars to a native array('f') """
+    
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    
+    values = array('f')
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    
+    if sys.byteorder == 'little':
+        values.byteswap()
+    
+    return values
@@ -23,28 +23,22 @@
 A little-modbus TCP / Serial  data log reader
 """
 
+from __future__ import print_function
+
 import os
 import sys
 import time
+import numbers
 import calendar
 import datetime
 import argparse
 
-try:
-    import sqlite3
-except:
-    pass
-
-from ltmodbus import LTModbusTCP, LTModbusSerial
 
-SQL_DATA_TABLE = '''create table if not exists data (
-            timestamp integer primary key, time text,
-            p01 numeric, p02 numeric, p03 numeric, p04 numeric, p05 numeric,
-            p06 numeric, p07 numeric, p08 numeric, p09 numeric, p10 numeric,
-            p11 numeric, p12 numeric, p13 numeric, p14 numeric, p15 numeric,
-            p16 numeric, p17 numeric, p18 numeric);'''
-CSV_DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S"
-SQL_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.000000"
+from ltmodbus import LTModbusTCP, LTModbusSerial, float_struct
+from ltmodbus_retry import RetryPolicy
+from ltmodbus_metrics import Metrics
+from ltmodbus_sink import SQLiteSink, SQL_DATA_TABLE, SQL_DATETIME_FORMAT
+from ltmodbus_sink import CSV_DATETIME_FORMAT
 
 class LTModbusLogger():
     """ a little modbus module
@@ -55,18 +49,32 @@ class LTModbusLogger():
     def __init__(self, soc):
         self.soc = soc
         self.unit = 31
+        
+        # read date and data in one request
+        self.block_read = True
+        self.transactions_saved = 0
     
     def set_date(self,d,m,y,h,M,s):
         """ set reading frame to date
         """
         
         self.soc.set_par(self.unit, 5941, 6, [d,m,y,h,M,s])
+        self._invalidate_frame()
         
     def inc_date(self):
         """ set reading frame to next frame
         """
         
         self.soc.set_par(self.unit, 5940, 1, [0,])
+        self._invalidate_frame()
+    
+    def _invalidate_frame(self):
+        """ drop cached frame date and data after moving the reading frame
+        """
+        
+        # frame date and data are in pars 5941 ... 5968
+        if hasattr(self.soc, 'invalidate'):
+            self.soc.invalidate(self.unit, 5941, 28)
     
     def read_points(self):
         """ read data log register number points
@@ -81,40 +89,196 @@ class LTModbusLogger():
         return a tupple of current reading line (timestamp, data... )
         """
         
-        # data is in pars 5951 ...
-        data = self.soc.get_par(self.unit, 5951, 18)
+        if self.block_read:
+            # date and time are in pars 5941 ... and data in pars 5951 ...
+            block = self.soc.get_par(self.unit, 5941, 28)
+            d,m,y,h,M,s = block[:6]
+            data = block[10:]
+            
+            self.transactions_saved += 1
+        else:
+            # data is in pars 5951 ...
+            data = self.soc.get_par(self.unit, 5951, 18)
+            
+            # date and time are in pars 5941 ...
+            d,m,y,h,M,s = self.soc.get_par(self.unit, 5941, 6)
+        
+        time_tuple = tuple([int(v) for v in (y,m,d,h,M,s,0,0,0)])
+        
+        try:
+            timestamp = calendar.timegm(time_tuple)
+        except:
+            timestamp = 0
+        
+        return (timestamp,) + tuple(data)
+    
+    def read_raw_data(self):
+        """ read current frame date and undecoded data
+        
+        return a tupple of (timestamp, data chars), the data chars are 
+        4 big endian chars for each data paramter.
+        """
+        
+        if self.block_read:
+            # date and time are in pars 5941 ... and data in pars 5951 ...
+            block = self.soc.get_raw(self.unit, 5941, 28)
+            date = float_struct(6).unpack_from(block, 0)
+            data = block[40:]
+            
+            self.transactions_saved += 1
+        else:
+            # date and time are in pars 5941 ...
+            date = self.soc.get_par(self.unit, 5941, 6)
+            
+            # data is in pars 5951 ...
+            data = self.soc.get_raw(self.unit, 5951, 18)
         
-        # date and time are in pars 5941 ...
-        d,m,y,h,M,s = self.soc.get_par(self.unit, 5941, 6)
-        time_tuple = map(int, (y,m,d,h,M,s,0,0,0))
+        d,m,y,h,M,s = date
+        time_tuple = tuple([int(v) for v in (y,m,d,h,M,s,0,0,0)])
         
         try:
             timestamp = calendar.timegm(time_tuple)
         except:
             timestamp = 0
         
-        return (timestamp,) + data
+        return (timestamp, data)
+    
+    def read_frames(self, n):
+        """ read n frames starting from the current frame
+        
+        n -- number of frames to read
+        
+        return a generator of reading lines (timestamp, data... ), see 
+            iter_frames
+        """
+        
+        return self.iter_frames(limit=n)
+    
+    def iter_frames(self, start=None, end=None, limit=None, raw=False):
+        """ read frames as they arrive
+        
+        start -- first frame date, None for the current frame
+        end -- stop when a frame date is after end, None for no time bound
+        limit -- max number of frames to read, None for no limit
+        raw -- yield (timestamp, data chars) tupples, see read_raw_data
+        
+        dates can be a datetime, a time tupple or a timestamp.
+        
+        return a generator of reading lines (timestamp, data... )
+        """
+        
+        if start is not None:
+            y,m,d,h,M,s = time.gmtime(frame_timestamp(start))[:6]
+            self.set_date(d,m,y,h,M,s)
+        
+        end = frame_timestamp(end)
+        
+        if raw:
+            read_data = self.read_raw_data
+        else:
+            read_data = self.read_data
+        
+        i = 0
+        while limit is None or i < limit:
+            frame = read_data()
+            
+            # stop before moving to the next frame
+            if end is not None and frame[0] > end:
+                return
+            
+            yield frame
+            
+            self.inc_date()
+            i += 1
+    
+    def read_frames_into(self, frames, start=None, end=None, limit=None):
+        """ read frames into a FrameBuffer without decoding them to floats
+        
+        frames -- a FrameBuffer
+        start, end, limit -- see iter_frames
+        
+        return -- number of frames read
+        """
+        
+        n = 0
+        for timestamp, data in self.iter_frames(start, end, limit, raw=True):
+            # if we have valid line 
+            if timestamp != 0:
+                frames.append(timestamp, data)
+                n += 1
+        
+        return n
+
+def frame_timestamp(value):
+    """ convert a datetime, time tupple or timestamp to a frame timestamp
+    
+    frame dates are unit local time, and are kept as if they were utc.
+    """
+    
+    if value is None:
+        return None
+    
+    if isinstance(value, numbers.Real):
+        return int(value)
+    
+    if hasattr(value, 'timetuple'):
+        value = value.timetuple()
+    
+    return calendar.timegm(tuple(value[:6]) + (0,0,0))
+
+def last_csv_timestamp(filename):
+    """ get the timestamp of the last line in a csv file
+    
+    return -- the timestamp or None for a missing or empty file
+    """
+    
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return None
+    
+    # the last line is in the end of the file
+    try:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        lines = f.read().decode('ascii', 'replace').splitlines()
+    finally:
+        f.close()
+    
+    for line in reversed(lines):
+        try:
+            struct_time = time.strptime(line.split(',')[0], CSV_DATETIME_FORMAT)
+            return calendar.timegm(struct_time)
+        except ValueError:
+            pass
+    
+    return None
 
-def dump_line(f, c, frame):
+def dump_line(f, c, frame, hooks=None):
     """ dump data line to data-base, csv-file and stdout
+    
+    hooks -- transaction hooks to time the write, see ltmodbus_metrics
     """
     
+    if hooks is not None:
+        start = time.time()
+    
     frame_time_str_csv = time.strftime(CSV_DATETIME_FORMAT, time.gmtime(frame[0]))
-    frame_time_str_sql = time.strftime(SQL_DATETIME_FORMAT, time.gmtime(frame[0]))
     
     csv_line = "%s,%s" % (frame_time_str_csv, ",".join(["%.02f" % p for p in frame[1:]]))
-    sql_line = "%d,'%s',%s" % (frame[0], frame_time_str_sql, ",".join(["%.02f" % p for p in frame[1:]]))
     
-    print csv_line
+    print(csv_line)
     
     try:
         if f:
-            f.write("%s\n" % csv_line)
+            f.write(("%s\n" % csv_line).encode('ascii'))
         if c:
-            sql = '''insert into data values (%s);''' % sql_line
-            c.execute(sql)
+            c.write(frame)
     except Exception:
-        print "Err: %s" % "can't write to file"
+        print("Err: %s" % "can't write to file")
+    
+    if hooks is not None:
+        hooks.sink(time.time() - start)
 
 def main():
     """ get user arguments and run the modbus repeater
@@ -141,12 +305,27 @@ def main():
     parser.add_argument('-t', dest='time_str',
                        type=str, default='',
                        help='time in "dd/mm/yyyy hh:mm:ss" fromat')
+    parser.add_argument('-e', dest='end_time_str',
+                       type=str, default='',
+                       help='stop after time in "dd/mm/yyyy hh:mm:ss" fromat')
     parser.add_argument('-n', dest='num',
                        type=int, default=20,
                        help='number of frames to read (default: 20)')
     parser.add_argument('-f', dest='filename',
                        type=str, default='',
                        help='.csv file name or .sqlite db')
+    parser.add_argument('-w', dest='wal',
+                       action='store_true',
+                       help='use write ahead log journal for .sqlite db')
+    parser.add_argument('-r', dest='resume',
+                       action='store_true',
+                       help='read only frames newer then the last frame in file')
+    parser.add_argument('-a', dest='retries',
+                       type=int, default=None,
+                       help='retry failed requests, timeouts adapt to the unit')
+    parser.add_argument('-m', dest='metrics',
+                       type=str, default='',
+                       help='write prometheus metrics to file')
                        
     args = parser.parse_args()
     
@@ -159,6 +338,14 @@ def main():
             baudrate=args.baudrate, bytesize=8, parity=args.parity, stopbits=1)
         soc.timeout = 1.5
     
+    # retry failed requests
+    if args.retries is not None:
+        soc.retry = RetryPolicy(retries=args.retries)
+    
+    # count transactions
+    if args.metrics:
+        soc.hooks = Metrics()
+    
     # create comunication object
     ser = LTModbusLogger(soc)
     
@@ -176,45 +363,60 @@ def main():
         now -= datetime.timedelta(hours=1)
         y,m,d,h,M,s,wd,yd,tz = now.timetuple()
     
+    # set end timestamp
+    try:
+        end = time.strptime(args.end_time_str, "%d/%m/%Y %H:%M:%S")
+    except Exception:
+        end = None
+    
+    # last frame already in file
+    last = None
+    
     # open csv file
     if args.filename and args.filename.endswith('.csv'):
-        f = open(args.filename,'wb')
+        if args.resume:
+            last = last_csv_timestamp(args.filename)
+            f = open(args.filename,'ab')
+        else:
+            f = open(args.filename,'wb')
     else:
         f = None
     
     # open sqlite db
     if args.filename and args.filename.endswith('.sqlite'):
-        conn = sqlite3.connect(args.filename)
-        c = conn.cursor()
-        
-        sql = SQL_DATA_TABLE
-        c.execute(sql)
-        conn.commit()
+        c = SQLiteSink(args.filename, wal=args.wal)
+        if args.resume:
+            last = c.last_timestamp()
     else:
         c = None
     
+    # resume just after the last frame
+    if last is not None:
+        y,m,d,h,M,s = time.gmtime(last + 1)[:6]
+    else:
+        last = 0
+    
     # get points
     points = ser.read_points()
-    print "points: timestamp, %s" % ",".join(["P%02d " % p for p in points])
+    print("points: timestamp, %s" % ",".join(["P%02d " % p for p in points]))
     
     # read N frames starting from timestamp
-    ser.set_date(d,m,y,h,M,s)
+    for frame in ser.iter_frames((y,m,d,h,M,s), end, args.num):
+        # if we have valid and new line 
+        if frame[0] > last:
+            dump_line(f, c, frame, soc.hooks)
+    
+    print("transactions saved: %d" % ser.transactions_saved)
+    
+    if args.metrics:
+        with open(args.metrics, 'w') as m:
+            m.write(soc.hooks.prometheus())
     
-    # read data
-    for i in range(args.num):
-        # get new data line
-        frame = ser.read_data()
-        ser.inc_date()
-        
-        # if we have valid line 
-        if frame[0] != 0:
-            dump_line(f, c, frame)
-            
     # close open files
     if f:
         f.close()
     if c:
-        conn.commit()
+        c.close()
     
     # close socket
     soc.close()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_metrics.py
+
+Transaction hooks and metrics for little modbus modules
+
+usage:
+    metrics = Metrics()
+    soc.hooks = metrics
+    ...
+    open('ltmodbus.prom', 'w').write(metrics.prometheus())
+    metrics.push_statsd('127.0.0.1', 8125)
+
+one Metrics object can be shared by several serial and TCP/IP modules.
+modules without hooks (the default) only pay one attribute check per
+request.
+"""
+
+import time
+import socket
+import threading
+
+from ltmodbus import LTModbusTimeout
+
+# latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5)
+
+# max size of a statsd datagram
+STATSD_DATAGRAM_SIZE = 512
+
+class Hooks():
+    """ transaction hooks that do nothing
+    
+    subclass and set as soc.hooks to watch the requests of a module.
+    """
+    
+    def before(self, unit, function):
+        """ called before a request is sent
+        
+        return -- a token passed to after, e.g. the start time
+        """
+        
+        return None
+    
+    def after(self, unit, function, token, sent, received, error=None):
+        """ called after an answer is parsed or the request failed
+        
+        token -- the value returned by before
+        sent, received -- modbus message chars, without CRC or MBAP header
+        error -- the LTModbusError of a failed request, None on success
+        """
+        
+        pass
+    
+    def event(self, name, unit, n=1):
+        """ called on events, e.g. cache_hit, cache_miss and retry """
+        
+        pass
+    
+    def sink(self, seconds):
+        """ called after a frame is written to the sinks """
+        
+        pass
+
+class Histogram():
+    """ a cumulative latency histogram """
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        """ add a value """
+        
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class UnitMetrics():
+    """ counters and latency histogram of one (unit, function) """
+    
+    def __init__(self, buckets):
+        self.transactions = 0
+        self.timeouts = 0
+        self.sent = 0
+        self.received = 0
+        
+        # error name -> count
+        self.errors = {}
+        
+        self.latency = Histogram(buckets)
+
+class Metrics(Hooks):
+    """ count transactions, errors and bytes, and measure latency
+    
+    metrics are kept for each (unit, function code), events for each
+    (event name, unit).
+    """
+    
+    def __init__(self, buckets=LATENCY_BUCKETS, prefix='ltmodbus'):
+        """ create empty metrics
+        
+        buckets -- latency histogram bucket bounds in seconds
+        prefix -- metric names prefix
+        """
+        
+        self.buckets = buckets
+        self.prefix = prefix
+        
+        # (unit, function) -> UnitMetrics
+        self.units = {}
+        
+        # (event, unit) -> count
+        self.events = {}
+        
+        self.sinks = Histogram(buckets)
+        self.lock = threading.Lock()
+        
+        # statsd counters already pushed
+        self.pushed = {}
+    
+    def before(self, unit, function):
+        """ return the request start time """
+        
+        return time.time()
+    
+    def after(self, unit, function, token, sent, received, error=None):
+        """ count a finished request """
+        
+        latency = time.time() - token
+        
+        with self.lock:
+            metrics = self.units.get((unit, function))
+            if metrics is None:
+                metrics = self.units[(unit, function)] = UnitMetrics(
+                    self.buckets)
+            
+            metrics.transactions += 1
+            metrics.sent += sent
+            metrics.received += received
+            
+            if error is None:
+                metrics.latency.observe(latency)
+            elif isinstance(error, LTModbusTimeout):
+                metrics.timeouts += 1
+            else:
+                name = type(error).__name__
+                metrics.errors[name] = metrics.errors.get(name, 0) + 1
+    
+    def event(self, name, unit, n=1):
+        """ count an event """
+        
+        with self.lock:
+            self.events[(name, unit)] = self.events.get((name, unit), 0) + n
+    
+    def sink(self, seconds):
+        """ measure a frame write """
+        
+        with self.lock:
+            self.sinks.observe(seconds)
+    
+    def counters(self):
+        """ get all counters
+        
+        return -- a dict of (name, labels tupple) -> value
+        """
+        
+        counters = {}
+        
+        with self.lock:
+            for (unit, function), metrics in self.units.items():
+                labels = (('unit', unit), ('function', function))
+                counters[('transactions_total', labels)] = metrics.transactions
+                counters[('timeouts_total', labels)] = metrics.timeouts
+                counters[('sent_bytes_total', labels)] = metrics.sent
+                counters[('received_bytes_total', labels)] = metrics.received
+                
+                for error, count in metrics.errors.items():
+                    counters[('errors_total', labels +
+                        (('error', error), ))] = count
+            
+            for (name, unit), count in self.events.items():
+                counters[('events_total', (('unit', unit),
+                    ('event', name)))] = count
+        
+        return counters
+    
+    def prometheus(self):
+        """ get the metrics in prometheus text format """
+        
+        lines = []
+        
+        counters = self.counters()
+        for name in sorted(set([key[0] for key in counters])):
+            metric = '%s_%s' % (self.prefix, name)
+            lines.append('# TYPE %s counter' % metric)
+            
+            for key in sorted([key for key in counters if key[0] == name]):
+                lines.append('%s%s %d' % (metric, _labels(key[1]),
+                    counters[key]))
+        
+        with self.lock:
+            histograms = [((('unit', unit), ('function', function)),
+                metrics.latency) for (unit, function), metrics in
+                sorted(self.units.items())]
+            
+            metric = '%s_latency_seconds' % self.prefix
+            lines.append('# TYPE %s histogram' % metric)
+            for labels, histogram in histograms:
+                lines.extend(self._histogram_lines(metric, labels, histogram))
+            
+            metric = '%s_sink_seconds' % self.prefix
+            lines.append('# TYPE %s histogram' % metric)
+            lines.extend(self._histogram_lines(metric, (), self.sinks))
+        
+        return '\n'.join(lines) + '\n'
+    
+    def push_statsd(self, host='127.0.0.1', port=8125):
+        """ send counters changed since the last push, and mean latencies
+        to a statsd daemon
+        """
+        
+        lines = []
+        
+        for (name, labels), value in sorted(self.counters().items()):
+            stat = '.'.join([self.prefix, name] +
+                ['%s_%s' % label for label in labels])
+            
+            delta = value - self.pushed.get(stat, 0)
+            self.pushed[stat] = value
+            
+            if delta:
+                lines.append('%s:%d|c' % (stat, delta))
+        
+        with self.lock:
+            for (unit, function), metrics in sorted(self.units.items()):
+                histogram = metrics.latency
+                if histogram.count:
+                    lines.append('%s.latency.unit%s.function%s:%.3f|ms' % (
+                        self.prefix, unit, function,
+                        1000.0 * histogram.sum / histogram.count))
+        
+        soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # pack lines into datagrams
+            datagram = ''
+            for line in lines:
+                if datagram and len(datagram) + len(line) >= STATSD_DATAGRAM_SIZE:
+                    soc.sendto(datagram.encode('ascii'), (host, port))
+                    datagram = ''
+                datagram += line + '\n'
+            
+            if datagram:
+                soc.sendto(datagram.encode('ascii'), (host, port))
+        finally:
+            soc.close()
+    
+    def _histogram_lines(self, metric, labels, histogram):
+        """ get prometheus lines of a histogram, the lock must be held """
+        
+        lines = []
+        
+        count = 0
+        for bound, n in zip(self.buckets + ('+Inf', ), histogram.counts):
+            count += n
+            lines.append('%s_bucket%s %d' % (metric,
+                _labels(labels + (('le', bound), )), count))
+        
+        lines.append('%s_sum%s %f' % (metric, _labels(labels), histogram.sum))
+        lines.append('%s_count%s %d' % (metric, _labels(labels),
+            histogram.count))
+        
+        return lines
+
+def _labels(labels):
+    """ format prometheus labels """
+    
+    if not labels:
+        return ''
+    
+    return '{%s}' % ','.join(['%s="%s"' % label for label in labels])
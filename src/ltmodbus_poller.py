@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_poller.py
+
+Poll live paramter values of many units
+
+paramters are read in scan groups, each group has its own scan period.
+groups of one unit that are due together are read using one read_many
+call, units on different buses are polled in parallel.
+
+usage:
+    ltmodbus_poller.py 31@COM1:5951-5968/1 31@COM1:5975-5992/60
+    ltmodbus_poller.py -D 0.1 -H 900 31@COM1:5951-5968/1
+"""
+
+import time
+import heapq
+import argparse
+import threading
+
+from ltmodbus import LTModbusError
+from ltmodbus_scheduler import open_bus
+from ltmodbus_sink import PrintSink, DeadbandFilter
+
+class ScanGroup():
+    """ paramters of one unit read every period seconds """
+    
+    def __init__(self, unit, addrs, period, name=None):
+        """ create a scan group
+        
+        unit -- modbus unit number
+        addrs -- a list of paramter addresses
+        period -- seconds between reads
+        name -- group name, default is unit/period
+        """
+        
+        self.unit = unit
+        self.addrs = list(addrs)
+        self.period = period
+        self.name = name or '%d/%g' % (unit, period)
+        
+        # statistics
+        self.reads = 0
+        self.errors = 0
+        self.overruns = 0
+
+class LTModbusPoller():
+    """ poll scan groups, one worker thread for each bus
+    
+    each bus keeps its groups in a heap ordered by the next read time.
+    groups that are due within merge_window seconds are read together,
+    a group that misses its next read time counts an overrun and skips
+    the missed reads.
+    
+    values are published to sink.publish(unit, timestamp, values), where
+    values is a dict of addr -> value, or None when the read failed.
+    """
+    
+    def __init__(self, sink, merge_window=0.05):
+        """ create a poller
+        
+        sink -- an object with a publish method
+        merge_window -- seconds, groups due this soon are read now
+        """
+        
+        self.sink = sink
+        self.merge_window = merge_window
+        
+        # bus -> (opener, list of ScanGroup)
+        self.buses = {}
+        
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+    
+    def add(self, bus, opener, group):
+        """ add a scan group
+        
+        bus -- the bus key, e.g. serial port name or gateway ip
+        opener -- a function that returns an open LTModbus module for bus
+        group -- a ScanGroup
+        """
+        
+        if bus not in self.buses:
+            self.buses[bus] = (opener, [])
+        
+        self.buses[bus][1].append(group)
+    
+    def run(self, duration=None):
+        """ poll all buses until stop is called or for duration seconds
+        """
+        
+        workers = []
+        for bus, (opener, groups) in self.buses.items():
+            worker = threading.Thread(target=self._run_bus,
+                args=(bus, opener, groups))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        
+        start = time.time()
+        try:
+            # wait in short steps, to get keyboard interrupts
+            while not self.stopped.is_set():
+                step = 0.5
+                if duration is not None:
+                    step = min(step, start + duration - time.time())
+                    if step <= 0:
+                        break
+                self.stopped.wait(step)
+        finally:
+            self.stop()
+            
+            for worker in workers:
+                worker.join()
+    
+    def stop(self):
+        """ stop polling """
+        
+        self.stopped.set()
+    
+    def _run_bus(self, bus, opener, bus_groups):
+        """ poll the groups of one bus """
+        
+        soc = None
+        try:
+            # (next read time, index, group)
+            now = time.time()
+            heap = [(now, i, group) for i, group in enumerate(bus_groups)]
+            heapq.heapify(heap)
+            
+            while not self.stopped.is_set():
+                # wait for the next due group
+                delay = heap[0][0] - time.time()
+                if delay > 0 and self.stopped.wait(delay):
+                    break
+                
+                # pop the groups due now, or in the merge window
+                due = []
+                horizon = time.time() + self.merge_window
+                while heap and heap[0][0] <= horizon:
+                    due.append(heapq.heappop(heap))
+                
+                groups = [group for deadline, i, group in due]
+                
+                if soc is None:
+                    soc = self._open(opener)
+                
+                if soc is None:
+                    self._publish_errors(groups)
+                else:
+                    try:
+                        self._poll(soc, groups)
+                    except Exception:
+                        # a broken bus, open it again on the next read
+                        self._publish_errors(groups)
+                        soc.close()
+                        soc = None
+                
+                # schedule the next reads, skip missed reads
+                now = time.time()
+                for deadline, i, group in due:
+                    deadline += group.period
+                    if deadline < now:
+                        missed = int((now - deadline) // group.period) + 1
+                        group.overruns += missed
+                        deadline += missed * group.period
+                        
+                        if soc is not None and soc.hooks is not None:
+                            soc.hooks.event('overrun', group.unit, missed)
+                    
+                    heapq.heappush(heap, (deadline, i, group))
+        finally:
+            if soc is not None:
+                soc.close()
+    
+    def _open(self, opener):
+        """ open a bus, return None on failure, a failed bus is opened again
+        on the next read
+        """
+        
+        try:
+            return opener()
+        except Exception:
+            return None
+    
+    def _poll(self, soc, groups):
+        """ read due groups, one read_many call for each unit """
+        
+        units = {}
+        for group in groups:
+            units.setdefault(group.unit, []).append(group)
+        
+        for unit, unit_groups in units.items():
+            addrs = set()
+            for group in unit_groups:
+                addrs.update(group.addrs)
+            
+            timestamp = time.time()
+            try:
+                values = soc.read_many(unit, addrs)
+            except LTModbusError:
+                self._publish_errors(unit_groups)
+                continue
+            
+            for group in unit_groups:
+                group.reads += 1
+                self._publish(unit, timestamp,
+                    dict([(addr, values[addr]) for addr in group.addrs]))
+    
+    def _publish_errors(self, groups):
+        """ publish failed reads """
+        
+        timestamp = time.time()
+        for group in groups:
+            group.errors += 1
+            self._publish(group.unit, timestamp, None)
+    
+    def _publish(self, unit, timestamp, values):
+        """ publish values, sinks are called by one bus at a time """
+        
+        with self.lock:
+            self.sink.publish(unit, timestamp, values)
+
+def parse_group(text):
+    """ parse a unit@bus:addrs/period scan group argument
+    
+    addrs is a comma separated list of paramter addresses and ranges,
+    e.g. 31@COM1:5951-5968,5975/10
+    
+    return -- bus and a ScanGroup
+    """
+    
+    unit_bus, addrs_period = text.rsplit(':', 1)
+    unit, bus = unit_bus.split('@', 1)
+    addrs_text, period = addrs_period.split('/', 1)
+    
+    addrs = []
+    for part in addrs_text.split(','):
+        if '-' in part:
+            first, last = part.split('-', 1)
+            addrs.extend(range(int(first), int(last) + 1))
+        else:
+            addrs.append(int(part))
+    
+    return bus, ScanGroup(int(unit), addrs, float(period))
+
+def main():
+    """ get user arguments and run the poller
+    """
+    
+    # command line parser
+    parser = argparse.ArgumentParser(
+        description='LT-Modbus live values poller.')
+    
+    parser.add_argument('groups', metavar='unit@bus:addrs/period',
+                       type=str, nargs='+',
+                       help='scan group, e.g. 31@COM1:5951-5968,5975/10')
+    parser.add_argument('-b', dest='baudrate',
+                       type=int, default=4800,
+                       help='serial port baudrate (default: 4800)')
+    parser.add_argument('-p', dest='parity',
+                       type=str, default='E',
+                       help='serial port parity (default: E)')
+    parser.add_argument('-a', dest='retries',
+                       type=int, default=None,
+                       help='retry failed requests, timeouts adapt to the unit')
+    parser.add_argument('-n', dest='duration',
+                       type=float, default=None,
+                       help='seconds to poll (default: until interrupted)')
+    parser.add_argument('-D', dest='deadband',
+                       type=float, default=None,
+                       help='print only values that changed more than deadband')
+    parser.add_argument('-P', dest='percent',
+                       type=float, default=0.0,
+                       help='deadband in percent of the last value (default: 0)')
+    parser.add_argument('-H', dest='heartbeat',
+                       type=float, default=None,
+                       help='max seconds between printing a value, with -D or -P')
+    
+    args = parser.parse_args()
+    
+    sink = PrintSink()
+    if args.deadband is not None or args.percent:
+        sink = DeadbandFilter(sink, args.deadband or 0.0, args.percent,
+            args.heartbeat)
+    
+    poller = LTModbusPoller(sink)
+    
+    openers = {}
+    groups = []
+    for text in args.groups:
+        bus, group = parse_group(text)
+        if bus not in openers:
+            openers[bus] = open_bus(bus, args)
+        poller.add(bus, openers[bus], group)
+        groups.append(group)
+    
+    try:
+        poller.run(args.duration)
+    except KeyboardInterrupt:
+        poller.stop()
+    
+    for group in groups:
+        print("%s: %d reads, %d errors, %d overruns" % (group.name,
+            group.reads, group.errors, group.overruns))
+    
+    if isinstance(sink, DeadbandFilter):
+        print("deadband: %d of %d values printed" % (sink.published,
+            sink.received))
+
+if __name__ == '__main__':
+    main()
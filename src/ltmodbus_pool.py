@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_pool.py
+
+A connection pool of little modbus TCP/IP modules
+
+usage:
+    pool = LTModbusTCPPool()
+    
+    with pool.connection('192.168.1.10') as soc:
+        ser = LTModbusLogger(soc)
+        ...
+"""
+
+import time
+import threading
+
+from contextlib import contextmanager
+
+from ltmodbus import LTModbusTCP
+
+class LTModbusTCPPool():
+    """ a pool of open LTModbusTCP modules keyed by (ip, port)
+    
+    connections are checked on checkout, at most max_size connections
+    are open for each gateway and idle connections are closed after
+    idle_timeout seconds.
+    """
+    
+    def __init__(self, max_size=4, idle_timeout=60, timeout=2):
+        # max open connections for each gateway
+        self.max_size = max_size
+        
+        # seconds before an idle connection is closed
+        self.idle_timeout = idle_timeout
+        
+        # seconds to wait for a free connection
+        self.timeout = timeout
+        
+        # (ip, port) -> list of (soc, last use time)
+        self.idle = {}
+        
+        # (ip, port) -> number of open connections
+        self.size = {}
+        
+        self.lock = threading.Condition()
+    
+    def get(self, ip, port=502):
+        """ get an open connection to a gateway
+        
+        ip -- gateway ip
+        port -- gateway port
+        
+        return -- an open LTModbusTCP module
+        """
+        
+        key = (ip, port)
+        deadline = time.time() + self.timeout
+        
+        self.lock.acquire()
+        try:
+            self._close_idle(time.time())
+            
+            while True:
+                # reuse the last returned healthy connection
+                idle = self.idle.get(key, [])
+                while idle:
+                    soc, last_used = idle.pop()
+                    if soc.is_open():
+                        return soc
+                    self._discard(soc)
+                
+                # open a new connection
+                if self.size.get(key, 0) < self.max_size:
+                    self.size[key] = self.size.get(key, 0) + 1
+                    break
+                
+                # wait for a connection to return to the pool
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Exception("No free connection to unit")
+                self.lock.wait(remaining)
+        finally:
+            self.lock.release()
+        
+        # connect outside the lock
+        soc = LTModbusTCP(ip, port)
+        try:
+            soc.open()
+        except Exception:
+            self.lock.acquire()
+            try:
+                self.size[key] -= 1
+                self.lock.notify()
+            finally:
+                self.lock.release()
+            raise
+        
+        return soc
+    
+    def put(self, soc, broken=False):
+        """ return a connection to the pool
+        
+        soc -- a connection from get
+        broken -- close the connection instead of reusing it
+        """
+        
+        self.lock.acquire()
+        try:
+            if broken:
+                self._discard(soc)
+            else:
+                key = (soc.ip, soc.tcp_port)
+                self.idle.setdefault(key, []).append((soc, time.time()))
+            
+            self.lock.notify()
+        finally:
+            self.lock.release()
+    
+    @contextmanager
+    def connection(self, ip, port=502):
+        """ get a connection and return it to the pool when done
+        
+        a connection that raised an exception is closed, it may hold
+        replies of requests that were never read.
+        """
+        
+        soc = self.get(ip, port)
+        try:
+            yield soc
+        except Exception:
+            self.put(soc, broken=True)
+            raise
+        else:
+            self.put(soc)
+    
+    def close_idle(self):
+        """ close connections that were idle more then idle_timeout """
+        
+        self.lock.acquire()
+        try:
+            self._close_idle(time.time())
+        finally:
+            self.lock.release()
+    
+    def close(self):
+        """ close all idle connections """
+        
+        self.lock.acquire()
+        try:
+            for key, idle in self.idle.items():
+                for soc, last_used in idle:
+                    self._discard(soc)
+            self.idle = {}
+        finally:
+            self.lock.release()
+    
+    def _close_idle(self, now):
+        """ close old idle connections, the lock must be held """
+        
+        for key, idle in self.idle.items():
+            fresh = []
+            for soc, last_used in idle:
+                if now - last_used > self.idle_timeout:
+                    self._discard(soc)
+                else:
+                    fresh.append((soc, last_used))
+            self.idle[key] = fresh
+    
+    def _discard(self, soc):
+        """ close a connection, the lock must be held """
+        
+        key = (soc.ip, soc.tcp_port)
+        self.size[key] -= 1
+        
+        try:
+            soc.close()
+        except Exception:
+            pass
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_retry.py
+
+An adaptive retry and timeout policy for little modbus modules
+
+usage:
+    soc.retry = RetryPolicy(retries=2)
+
+the answer timeout of each unit follows its measured response time,
+failed requests are retried with a growing delay, and units that keep
+failing are skipped for a while instead of stalling the bus.
+"""
+
+import time
+import threading
+
+from collections import deque
+
+from ltmodbus import LTModbusError, LTModbusTimeout, LTModbusFrameError
+from ltmodbus import LTModbusExceptionResponse
+
+class LTModbusUnitDead(LTModbusTimeout):
+    """ the unit is skipped, it did not answer the last requests """
+    pass
+
+class UnitStats():
+    """ response time statistics of one unit """
+    
+    def __init__(self, samples):
+        # smoothed response time and mean deviation
+        self.ewma = None
+        self.deviation = 0.0
+        
+        # last response times
+        self.samples = deque(maxlen=samples)
+        
+        # failed calls in a row, and when to try a dead unit again
+        self.failures = 0
+        self.dead_until = 0
+
+class RetryPolicy():
+    """ retry failed requests and adapt the answer timeout of each unit
+    
+    until min_samples answers are measured the timeout is the smoothed
+    response time plus 4 mean deviations, later it is the 99th percentile
+    of the last answers times k. timeouts are clamped to min_timeout ...
+    max_timeout and doubled on each retry.
+    
+    response times are measured without the time needed to transfer the
+    answer (see LTModbus.transfer_time), and the transfer time of each
+    answer is added to its timeout, so a long answer on a slow serial bus
+    is not timed out by the response times of short answers. an answer
+    to a retry of a timed out request is measured only when the module
+    drops late answers, otherwise it may be the late answer of the timed
+    out try.
+    
+    timeouts are retried after a bounded exponential backoff, corrupted
+    answers are retried at once and modbus exception answers are not
+    retried. writes are not retried unless retry_writes is set, a write
+    may have been done even when its answer was lost (e.g. inc_date).
+    
+    a unit that failed dead_after calls in a row is skipped for dead_time
+    seconds, then one call is tried again.
+    """
+    
+    def __init__(self, retries=2, k=3.0, min_timeout=0.05, max_timeout=2.0,
+            backoff=0.05, max_backoff=1.0, alpha=0.125, samples=100,
+            min_samples=20, dead_after=3, dead_time=60, retry_writes=False):
+        """ create a retry policy
+        
+        retries -- max retries of a failed request
+        k -- timeout multiplier of the 99th percentile response time
+        min_timeout, max_timeout -- timeout bounds in seconds
+        backoff, max_backoff -- first and max delay in seconds before
+            retrying a timed out request
+        alpha -- smoothing factor of the response time average
+        samples -- number of response times kept for the percentile
+        min_samples -- number of response times needed for the percentile
+        dead_after -- failed calls in a row before a unit is skipped
+        dead_time -- seconds a dead unit is skipped
+        retry_writes -- retry failed set_par requests
+        """
+        
+        self.retries = retries
+        self.k = k
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.alpha = alpha
+        self.samples = samples
+        self.min_samples = min_samples
+        self.dead_after = dead_after
+        self.dead_time = dead_time
+        self.retry_writes = retry_writes
+        
+        # unit -> UnitStats
+        self.units = {}
+        self.lock = threading.Lock()
+    
+    def call(self, soc, unit, function, write=False, answer_length=0):
+        """ call a request function using this policy
+        
+        soc -- the little modbus module, its answer timeout is set before
+            each try
+        unit -- modbus unit number
+        function -- a function that sends the request and parses the
+            answer, raising a LTModbusError on failure
+        write -- the request writes to the unit
+        answer_length -- the expected answer length in chars
+        
+        return -- the function result
+        """
+        
+        hooks = getattr(soc, 'hooks', None)
+        transfer = soc.transfer_time(answer_length)
+        
+        # a late answer of a timed out try may be taken as the answer of 
+        # the next try, unless the module drops late answers
+        measure = True
+        
+        if self.is_dead(unit):
+            if hooks is not None:
+                hooks.event('dead_skip', unit)
+            raise LTModbusUnitDead("Unit %d is not answering" % unit)
+        
+        retries = self.retries
+        if write and not self.retry_writes:
+            retries = 0
+        
+        attempt = 0
+        while True:
+            soc.set_timeout(self.timeout(unit, attempt, transfer))
+            
+            t = time.time()
+            try:
+                result = function()
+            except LTModbusExceptionResponse:
+                # the unit is alive, asking again will not help
+                if measure:
+                    self.record(unit, time.time() - t - transfer)
+                raise
+            except LTModbusError as e:
+                if attempt >= retries:
+                    self.failed(unit)
+                    raise
+                
+                if isinstance(e, LTModbusTimeout):
+                    measure = measure and soc.drops_late_answers
+                
+                # corrupted answers are retried at once
+                if not isinstance(e, LTModbusFrameError):
+                    time.sleep(self.backoff_delay(attempt))
+                
+                if hooks is not None:
+                    hooks.event('retry', unit)
+                
+                attempt += 1
+                continue
+            
+            if measure:
+                self.record(unit, time.time() - t - transfer)
+            
+            return result
+    
+    def timeout(self, unit, attempt=0, transfer=0.0):
+        """ get the answer timeout of a unit
+        
+        attempt -- the retry number, the timeout doubles on each retry
+        transfer -- seconds needed to transfer the answer
+        
+        return -- the timeout in seconds
+        """
+        
+        stats = self.units.get(unit)
+        
+        if stats is None or stats.ewma is None:
+            return round(self.max_timeout + transfer, 2)
+        
+        if len(stats.samples) < self.min_samples:
+            timeout = stats.ewma + 4 * stats.deviation
+        else:
+            timeout = self.k * self.percentile(unit, 0.99)
+        
+        timeout = min(max(timeout, self.min_timeout), self.max_timeout)
+        
+        # round to 10ms, a serial port is reconfigured on each change
+        return round(min(timeout * 2 ** attempt, self.max_timeout) + transfer,
+            2)
+    
+    def backoff_delay(self, attempt):
+        """ get the delay in seconds before a retry """
+        
+        return min(self.backoff * 2 ** attempt, self.max_backoff)
+    
+    def percentile(self, unit, p):
+        """ get a percentile of the last response times of a unit
+        
+        p -- the percentile, 0.0 ... 1.0
+        
+        return -- the response time in seconds or None
+        """
+        
+        stats = self.units.get(unit)
+        if stats is None or not stats.samples:
+            return None
+        
+        with self.lock:
+            samples = sorted(stats.samples)
+        
+        return samples[min(int(p * len(samples)), len(samples) - 1)]
+    
+    def record(self, unit, latency):
+        """ add a measured response time of a unit """
+        
+        latency = max(latency, 0.0)
+        
+        with self.lock:
+            stats = self._stats(unit)
+            
+            if stats.ewma is None:
+                stats.ewma = latency
+                stats.deviation = latency / 2
+            else:
+                error = latency - stats.ewma
+                stats.ewma += self.alpha * error
+                stats.deviation += self.alpha * (abs(error) - stats.deviation)
+            
+            stats.samples.append(latency)
+            stats.failures = 0
+            stats.dead_until = 0
+    
+    def failed(self, unit):
+        """ count a failed call of a unit """
+        
+        with self.lock:
+            stats = self._stats(unit)
+            stats.failures += 1
+            
+            if stats.failures >= self.dead_after:
+                stats.dead_until = time.time() + self.dead_time
+    
+    def is_dead(self, unit):
+        """ check if a unit is skipped """
+        
+        stats = self.units.get(unit)
+        
+        return stats is not None and time.time() < stats.dead_until
+    
+    def _stats(self, unit):
+        """ get the statistics of a unit, the lock must be held """
+        
+        stats = self.units.get(unit)
+        if stats is None:
+            stats = self.units[unit] = UnitStats(self.samples)
+        
+        return stats
+    
+    def stats(self):
+        """ return a dict of unit -> dict of unit statistics """
+        
+        return dict([(unit, {
+            'ewma': stats.ewma,
+            'p99': self.percentile(unit, 0.99),
+            'timeout': self.timeout(unit),
+            'failures': stats.failures,
+            'dead': self.is_dead(unit)})
+            for unit, stats in list(self.units.items())])
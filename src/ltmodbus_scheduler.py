@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_scheduler.py
+
+Read the data log of many units, one worker for each bus
+
+units on one serial port (or behind one TCP/IP gateway) are read one
+after the other, units on different buses are read in parallel.
+
+usage:
+    ltmodbus_scheduler.py -n 60 -r 31@COM1 32@COM1 5@192.168.1.10
+"""
+
+import os
+import re
+import time
+import datetime
+import argparse
+import threading
+
+from ltmodbus import LTModbusTCP, LTModbusSerial
+from ltmodbus_logger import LTModbusLogger, frame_timestamp
+from ltmodbus_retry import RetryPolicy
+from ltmodbus_sink import SQLiteSink
+
+class LTModbusScheduler():
+    """ read the data log of many units, one worker thread for each bus
+    """
+    
+    def __init__(self):
+        # bus -> (opener, list of jobs)
+        self.buses = {}
+        
+        # (bus, unit) -> number of frames read or the error
+        self.results = {}
+    
+    def add(self, bus, opener, unit, sink, start=None, end=None, limit=None,
+            resume=False):
+        """ add a unit to read
+        
+        bus -- the bus key, e.g. serial port name or gateway ip
+        opener -- a function that returns an open LTModbus module for bus
+        unit -- modbus unit number
+        sink -- a function that returns a frame sink for unit, the sink
+            is created in the bus worker thread
+        start, end, limit -- see LTModbusLogger.iter_frames
+        resume -- start after the last frame in the sink
+        """
+        
+        if bus not in self.buses:
+            self.buses[bus] = (opener, [])
+        
+        self.buses[bus][1].append((unit, sink, start, end, limit, resume))
+    
+    def run(self):
+        """ read all units and wait for all buses to finish
+        
+        return -- a dict of (bus, unit) -> frames read or the error
+        """
+        
+        workers = []
+        for bus, (opener, jobs) in self.buses.items():
+            worker = threading.Thread(target=self._run_bus,
+                args=(bus, opener, jobs))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        
+        for worker in workers:
+            worker.join()
+        
+        return self.results
+    
+    def _run_bus(self, bus, opener, jobs):
+        """ read the units of one bus one after the other """
+        
+        try:
+            soc = opener()
+        except Exception as e:
+            for job in jobs:
+                self.results[(bus, job[0])] = e
+            return
+        
+        try:
+            for unit, sink, start, end, limit, resume in jobs:
+                try:
+                    self.results[(bus, unit)] = self._run_unit(soc,
+                        unit, sink(), start, end, limit, resume)
+                except Exception as e:
+                    self.results[(bus, unit)] = e
+        finally:
+            soc.close()
+    
+    def _run_unit(self, soc, unit, sink, start, end, limit, resume):
+        """ read the data log of one unit into a sink
+        
+        return -- number of frames read
+        """
+        
+        ser = LTModbusLogger(soc)
+        ser.unit = unit
+        
+        # resume just after the last frame
+        last = 0
+        if resume:
+            last = sink.last_timestamp()
+            if last is not None:
+                start = last + 1
+            else:
+                last = 0
+        
+        n = 0
+        try:
+            for frame in ser.iter_frames(start, end, limit):
+                # if we have valid and new line
+                if frame[0] > last:
+                    sink.write(frame)
+                    n += 1
+        finally:
+            sink.close()
+        
+        return n
+
+def open_bus(bus, args):
+    """ return a function that opens a serial port or a TCP/IP gateway """
+    
+    def opener():
+        if re.match(r'^\d+\.\d+\.\d+\.\d+$', bus):
+            soc = LTModbusTCP(bus)
+            soc.open()
+        else:
+            soc = LTModbusSerial(port=bus, baudrate=args.baudrate,
+                bytesize=8, parity=args.parity, stopbits=1)
+            soc.timeout = 1.5
+        
+        # one policy for the bus, dead units are skipped
+        if args.retries is not None:
+            soc.retry = RetryPolicy(retries=args.retries)
+        
+        return soc
+    
+    return opener
+
+def open_sink(bus, unit, args):
+    """ return a function that opens the sqlite data base of a unit """
+    
+    filename = "%s_%d.sqlite" % (re.sub(r'[^\w.-]', '_', bus), unit)
+    
+    def opener():
+        return SQLiteSink(os.path.join(args.directory, filename))
+    
+    return opener
+
+def main():
+    """ get user arguments and run the scheduler
+    """
+    
+    # command line parser
+    parser = argparse.ArgumentParser(
+        description='LT-Modbus multi unit data log reader.')
+    
+    parser.add_argument('units', metavar='unit@bus',
+                       type=str, nargs='+',
+                       help='unit number and serial port or unit ip, e.g. 31@COM1')
+    parser.add_argument('-b', dest='baudrate',
+                       type=int, default=4800,
+                       help='serial port baudrate (default: 4800)')
+    parser.add_argument('-p', dest='parity',
+                       type=str, default='E',
+                       help='serial port parity (default: E)')
+    parser.add_argument('-t', dest='time_str',
+                       type=str, default='',
+                       help='time in "dd/mm/yyyy hh:mm:ss" fromat')
+    parser.add_argument('-e', dest='end_time_str',
+                       type=str, default='',
+                       help='stop after time in "dd/mm/yyyy hh:mm:ss" fromat')
+    parser.add_argument('-n', dest='num',
+                       type=int, default=20,
+                       help='number of frames to read (default: 20)')
+    parser.add_argument('-d', dest='directory',
+                       type=str, default='.',
+                       help='directory for the .sqlite db files')
+    parser.add_argument('-r', dest='resume',
+                       action='store_true',
+                       help='read only frames newer then the last frame in file')
+    parser.add_argument('-a', dest='retries',
+                       type=int, default=None,
+                       help='retry failed requests, timeouts adapt to the unit')
+    
+    args = parser.parse_args()
+    
+    # set timestamp
+    try:
+        start = time.strptime(args.time_str, "%d/%m/%Y %H:%M:%S")
+    except Exception:
+        # get a starting timestamp (now - one hour)
+        start = datetime.datetime.now() - datetime.timedelta(hours=1)
+    
+    # set end timestamp
+    try:
+        end = time.strptime(args.end_time_str, "%d/%m/%Y %H:%M:%S")
+    except Exception:
+        end = None
+    
+    scheduler = LTModbusScheduler()
+    for unit_bus in args.units:
+        unit, bus = unit_bus.split('@', 1)
+        scheduler.add(bus, open_bus(bus, args), int(unit),
+            open_sink(bus, int(unit), args),
+            frame_timestamp(start), end, args.num, args.resume)
+    
+    t = time.time()
+    results = scheduler.run()
+    
+    for (bus, unit), result in sorted(results.items()):
+        if isinstance(result, Exception):
+            print("%s unit %d: Err: %s" % (bus, unit, result))
+        else:
+            print("%s unit %d: %d frames" % (bus, unit, result))
+    
+    print("time: %.1fs" % (time.time() - t))
+
+if __name__ == '__main__':
+    main()
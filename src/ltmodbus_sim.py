@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_sim.py
+
+Simulated little modbus units for tests and benchmarks
+
+SimLogger implements the data logger paramters read by LTModbusLogger,
+RTUSlave answers on a serial pseudo terminal (posix only) and TCPServer
+answers modbus TCP/IP requests. both can add latency, jitter, the char
+time of a baudrate and errors to the answers.
+
+usage:
+    slave = RTUSlave([SimLogger(31)], baudrate=9600)
+    slave.start()
+    soc = LTModbusSerial(port=slave.port, baudrate=9600, timeout=1)
+    
+    server = TCPServer([SimLogger(31)], latency=0.005)
+    server.start()
+    soc = LTModbusTCP('127.0.0.1', server.tcp_port)
+    
+    ltmodbus_sim.py -u 31 -u 32 -b 9600 -t 5020
+"""
+
+import os
+import time
+import random
+import socket
+import calendar
+import argparse
+import threading
+
+from struct import Struct
+
+from ltmodbus import GET_PAR_REQUEST, MBAP_HEADER, MAX_MBAP_LENGTH
+from ltmodbus import float_struct, check_crc
+from ltmodbus import LTModbusCRCError
+from ltmodbus_crc import crc16_bytes
+
+try:
+    import pty
+    import tty
+except ImportError:
+    # no pseudo terminals
+    pass
+
+# set input registers request header: unit, function, addr, count, length
+SET_PAR_HEADER = Struct('>2B2HB')
+ANSWER_HEADER = Struct('>3B')
+
+# modbus exception codes
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+SLAVE_DEVICE_BUSY = 6
+
+class SimError(Exception):
+    """ a request the simulated unit answers with a modbus exception """
+    
+    def __init__(self, code):
+        Exception.__init__(self, "modbus exception %d" % code)
+        self.code = code
+
+class SimUnit():
+    """ a simulated little modbus unit
+    
+    paramters are floats kept in a dict, unset paramters read as 0.0.
+    """
+    
+    def __init__(self, unit=31):
+        self.unit = unit
+        
+        # paramter addr -> value
+        self.pars = {}
+        self.lock = threading.Lock()
+    
+    def get_pars(self, addr, count):
+        """ get paramter values """
+        
+        return [self.pars.get(addr + i, 0.0) for i in range(count)]
+    
+    def set_pars(self, addr, values):
+        """ set paramter values """
+        
+        for i, value in enumerate(values):
+            self.pars[addr + i] = value
+    
+    def handle(self, request):
+        """ answer a request
+        
+        request -- the request chars without CRC
+        
+        return -- the answer chars without CRC
+        """
+        
+        function = bytearray(request[1:2])[0]
+        
+        # modbus addr and count are of registers, paramters are 2 registers
+        try:
+            if function == 4:
+                unit, function, addr, count = GET_PAR_REQUEST.unpack_from(
+                    request)
+                with self.lock:
+                    values = self.get_pars((addr + 1) // 2, count // 2)
+                
+                return (ANSWER_HEADER.pack(unit, function, count * 2) +
+                    float_struct(len(values)).pack(*values))
+            
+            if function == 0x10:
+                unit, function, addr, count, length = (
+                    SET_PAR_HEADER.unpack_from(request))
+                values = float_struct(length // 4).unpack_from(request,
+                    SET_PAR_HEADER.size)
+                with self.lock:
+                    self.set_pars((addr + 1) // 2, values)
+                
+                return request[:6]
+            
+            raise SimError(ILLEGAL_FUNCTION)
+        except SimError as e:
+            return ANSWER_HEADER.pack(self.unit, function | 0x80, e.code)
+
+class SimLogger(SimUnit):
+    """ a simulated data logger unit
+    
+    the logger keeps a frame every interval seconds, the reading frame
+    paramters are:
+        5940 -- write to move to the next frame
+        5941 ... 5946 -- frame date: day, month, year, hour, minute, second
+        5951 ... 5968 -- frame data
+        5975 ... 5992 -- data log register number of each data paramter
+    
+    frame data is computed from the frame timestamp, so any frame can be
+    read again and compared.
+    """
+    
+    def __init__(self, unit=31, interval=60, start=None):
+        """ create a data logger
+        
+        interval -- seconds between frames
+        start -- timestamp of the reading frame, None for now
+        """
+        
+        SimUnit.__init__(self, unit)
+        
+        self.interval = interval
+        self.points = [float(i + 1) for i in range(18)]
+        
+        if start is None:
+            start = time.time()
+        self.timestamp = int(start) // interval * interval
+    
+    def frame(self, timestamp):
+        """ get the data of the frame at timestamp """
+        
+        n = timestamp // self.interval
+        
+        return [float((n + i) % 1000) + i / 100.0 for i in range(18)]
+    
+    def get_pars(self, addr, count):
+        """ get paramter values """
+        
+        y, m, d, h, M, s = time.gmtime(self.timestamp)[:6]
+        
+        self.pars.update(enumerate([d, m, y, h, M, s], 5941))
+        self.pars.update(enumerate(self.frame(self.timestamp), 5951))
+        self.pars.update(enumerate(self.points, 5975))
+        
+        return SimUnit.get_pars(self, addr, count)
+    
+    def set_pars(self, addr, values):
+        """ set paramter values """
+        
+        pars = dict(enumerate(values, addr))
+        
+        # move to the next frame
+        if 5940 in pars:
+            self.timestamp += self.interval
+        
+        # move to the first frame at or after a date
+        if 5941 in pars:
+            date = [pars.get(i, self.pars.get(i, 0)) for i in range(5941, 5947)]
+            d, m, y, h, M, s = [int(v) for v in date]
+            try:
+                timestamp = calendar.timegm((y, m, d, h, M, s, 0, 0, 0))
+            except (ValueError, OverflowError):
+                raise SimError(ILLEGAL_DATA_ADDRESS)
+            
+            self.timestamp = -(-timestamp // self.interval) * self.interval
+        
+        SimUnit.set_pars(self, addr, values)
+
+class SimBus():
+    """ answer timing and error injection of a simulated bus """
+    
+    def __init__(self, units, latency=0.0, jitter=0.0, drop_rate=0.0,
+            corrupt_rate=0.0, busy_rate=0.0, seed=None):
+        """ create a simulated bus
+        
+        units -- a list of SimUnit
+        latency -- seconds before the unit starts to answer
+        jitter -- max random seconds added to the latency
+        drop_rate -- part of the requests that are not answered
+        corrupt_rate -- part of the answers with a corrupted char
+        busy_rate -- part of the requests answered with slave device busy
+        seed -- random seed, for repeatable runs
+        """
+        
+        self.units = dict([(unit.unit, unit) for unit in units])
+        
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.busy_rate = busy_rate
+        self.random = random.Random(seed)
+        
+        # statistics
+        self.requests = 0
+        self.dropped = 0
+        self.corrupted = 0
+        
+        self.thread = None
+    
+    def answer(self, request):
+        """ answer a request after the bus latency
+        
+        request -- the request chars without CRC
+        
+        return -- the answer chars without CRC or None for no answer
+        """
+        
+        answer, delay = self.prepare(request)
+        if delay > 0:
+            time.sleep(delay)
+        
+        return answer
+    
+    def prepare(self, request):
+        """ answer a request without waiting for the bus latency
+        
+        return -- the answer chars without CRC or None for no answer, and 
+            the latency in seconds before the answer is sent
+        """
+        
+        self.requests += 1
+        
+        unit = self.units.get(bytearray(request[:1])[0])
+        if unit is None or self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return None, 0
+        
+        if self.random.random() < self.busy_rate:
+            function = bytearray(request[1:2])[0]
+            answer = ANSWER_HEADER.pack(unit.unit, function | 0x80,
+                SLAVE_DEVICE_BUSY)
+        else:
+            answer = unit.handle(request)
+        
+        return answer, self.latency + self.random.random() * self.jitter
+    
+    def corrupt(self, frame):
+        """ flip a random char of a frame by the corrupt rate """
+        
+        if self.random.random() >= self.corrupt_rate:
+            return frame
+        
+        self.corrupted += 1
+        
+        frame = bytearray(frame)
+        frame[self.random.randrange(len(frame))] ^= 0xff
+        
+        return bytes(frame)
+    
+    def start(self):
+        """ answer requests in a daemon thread """
+        
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def _run(self):
+        raise Exception("SimBus::_run - Not implementd")
+
+class RTUSlave(SimBus):
+    """ simulated units answering on a serial pseudo terminal
+    
+    port is the terminal name to open with LTModbusSerial. when baudrate
+    is set, answer chars are written at the pace of the baudrate, like on
+    a serial line.
+    """
+    
+    def __init__(self, units, baudrate=None, char_bits=11, **keywords):
+        """ create the pseudo terminal
+        
+        units -- a list of SimUnit
+        baudrate -- simulated baudrate, None for no char time
+        char_bits -- bits in one char, start, data, parity and stop bits
+        
+        see SimBus for more arguments.
+        """
+        
+        SimBus.__init__(self, units, **keywords)
+        
+        self.baudrate = baudrate
+        self.char_bits = char_bits
+        
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+    
+    def _run(self):
+        """ read requests and write answers """
+        
+        chars = b''
+        while True:
+            chars += os.read(self.master, 256)
+            
+            while True:
+                length = self._request_length(chars)
+                if length is None or len(chars) < length:
+                    break
+                
+                frame, chars = chars[:length], chars[length:]
+                try:
+                    request = check_crc(frame)
+                except LTModbusCRCError:
+                    # a bad request, drop all chars
+                    chars = b''
+                    break
+                
+                answer = self.answer(request)
+                if answer is None:
+                    continue
+                
+                frame = self.corrupt(answer + crc16_bytes(answer))
+                
+                if self.baudrate:
+                    self._write_paced(frame)
+                else:
+                    os.write(self.master, frame)
+    
+    def _write_paced(self, frame):
+        """ write frame chars at the pace of the baudrate """
+        
+        char_time = self.char_bits / float(self.baudrate)
+        
+        # write chunks of about 1ms, sleeping is not more precise
+        chunk = max(1, int(0.001 / char_time))
+        
+        start = time.time()
+        for i in range(0, len(frame), chunk):
+            # wait until the chunk chars were sent
+            wait = start + (i + chunk) * char_time - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            
+            os.write(self.master, frame[i:i + chunk])
+    
+    def _request_length(self, chars):
+        """ get the length of the request at the start of chars
+        
+        return -- the request length with CRC, or None when not known yet
+        """
+        
+        if len(chars) < 7:
+            return None
+        
+        if bytearray(chars[1:2])[0] == 0x10:
+            return 9 + bytearray(chars[6:7])[0]
+        
+        return 8
+
+class TCPServer(SimBus):
+    """ simulated units answering modbus TCP/IP requests
+    
+    each connection is served by its own thread. the latency is a round 
+    trip time, each answer is sent latency seconds after its request 
+    without holding back the next requests, so pipelined requests on a 
+    connection overlap.
+    """
+    
+    def __init__(self, units, tcp_ip='127.0.0.1', tcp_port=0, **keywords):
+        """ open a listening socket
+        
+        units -- a list of SimUnit
+        tcp_ip, tcp_port -- address to listen on, port 0 for any free port
+        
+        see SimBus for more arguments.
+        """
+        
+        SimBus.__init__(self, units, **keywords)
+        
+        self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.soc.bind((tcp_ip, tcp_port))
+        self.soc.listen(64)
+        
+        self.ip, self.tcp_port = self.soc.getsockname()
+    
+    def _run(self):
+        """ accept connections """
+        
+        while True:
+            connection, address = self.soc.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            
+            thread = threading.Thread(target=self._serve,
+                args=(connection, ))
+            thread.daemon = True
+            thread.start()
+    
+    def _serve(self, connection):
+        """ answer the requests of one connection """
+        
+        chars = b''
+        lock = threading.Lock()
+        try:
+            while True:
+                received = connection.recv(4096)
+                if not received:
+                    return
+                chars += received
+                
+                while len(chars) >= 6:
+                    transaction_id, protocol, length = MBAP_HEADER.unpack_from(
+                        chars)
+                    if protocol != 0 or length > MAX_MBAP_LENGTH:
+                        return
+                    if len(chars) < 6 + length:
+                        break
+                    
+                    request, chars = chars[6:6 + length], chars[6 + length:]
+                    
+                    answer, delay = self.prepare(request)
+                    if answer is None:
+                        continue
+                    
+                    frame = self.corrupt(MBAP_HEADER.pack(
+                        transaction_id, 0, len(answer)) + answer)
+                    
+                    # send later, keep reading requests meanwhile
+                    if delay > 0:
+                        timer = threading.Timer(delay, self._send,
+                            args=(connection, lock, frame))
+                        timer.daemon = True
+                        timer.start()
+                    else:
+                        self._send(connection, lock, frame)
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+    
+    def _send(self, connection, lock, frame):
+        """ send an answer frame, one frame at a time """
+        
+        with lock:
+            try:
+                connection.sendall(frame)
+            except socket.error:
+                pass
+
+def main():
+    """ get user arguments and run simulated units
+    """
+    
+    # command line parser
+    parser = argparse.ArgumentParser(
+        description='LT-Modbus simulated data logger units.')
+    
+    parser.add_argument('-u', dest='units',
+                       type=int, action='append',
+                       help='unit number, can be repeated (default: 31)')
+    parser.add_argument('-b', dest='baudrate',
+                       type=int, default=None,
+                       help='simulated serial baudrate (default: no char time)')
+    parser.add_argument('-t', dest='tcp_port',
+                       type=int, default=None,
+                       help='TCP/IP port, for TCP/IP units')
+    parser.add_argument('-l', dest='latency',
+                       type=float, default=0.0,
+                       help='answer latency in seconds')
+    parser.add_argument('-j', dest='jitter',
+                       type=float, default=0.0,
+                       help='max random latency in seconds')
+    parser.add_argument('-d', dest='drop_rate',
+                       type=float, default=0.0,
+                       help='part of the requests that are not answered')
+    parser.add_argument('-c', dest='corrupt_rate',
+                       type=float, default=0.0,
+                       help='part of the answers with a corrupted char')
+    
+    args = parser.parse_args()
+    
+    units = [SimLogger(unit) for unit in args.units or [31]]
+    keywords = dict(latency=args.latency, jitter=args.jitter,
+        drop_rate=args.drop_rate, corrupt_rate=args.corrupt_rate)
+    
+    if args.tcp_port is not None:
+        bus = TCPServer(units, '0.0.0.0', args.tcp_port, **keywords)
+        print("listening on port %d" % bus.tcp_port)
+    else:
+        bus = RTUSlave(units, args.baudrate, **keywords)
+        print("answering on %s" % bus.port)
+    
+    bus.start()
+    
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" ltmodbus_sink.py
+
+Data log frame sinks
+"""
+
+import sys
+import time
+
+from array import array
+
+try:
+    import sqlite3
+except:
+    pass
+
+SQL_DATA_TABLE = '''create table if not exists data (
+            timestamp integer primary key, time text,
+            p01 numeric, p02 numeric, p03 numeric, p04 numeric, p05 numeric,
+            p06 numeric, p07 numeric, p08 numeric, p09 numeric, p10 numeric,
+            p11 numeric, p12 numeric, p13 numeric, p14 numeric, p15 numeric,
+            p16 numeric, p17 numeric, p18 numeric);'''
+SQL_DATA_INSERT = '''insert or ignore into data values (%s);''' % (
+            ",".join(["?"] * 20))
+SQL_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.000000"
+
+SQL_SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+# csv format
+CSV_DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+class SQLiteSink():
+    """ write data log frames to a sqlite data base
+    
+    frames are inserted in batches using one prepared statement, and
+    commited every batch_size frames or commit_interval seconds. frames
+    with a timestamp that is already in the data base are ignored, so
+    reading the same frames again is harmless.
+    """
+    
+    def __init__(self, filename, batch_size=100, commit_interval=5,
+            wal=False, synchronous=None):
+        """ open a sqlite data base
+        
+        filename -- the data base file name
+        batch_size -- max number of frames waiting for commit
+        commit_interval -- max seconds between commits
+        wal -- use write ahead log journal mode
+        synchronous -- sqlite synchronous pragma (OFF, NORMAL, FULL, EXTRA)
+        """
+        
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        
+        self.conn = sqlite3.connect(filename)
+        
+        if wal:
+            self.conn.execute('pragma journal_mode=wal;')
+        
+        if synchronous is not None:
+            if synchronous.upper() not in SQL_SYNCHRONOUS:
+                raise Exception("Unknown synchronous mode %s" % synchronous)
+            self.conn.execute('pragma synchronous=%s;' % synchronous.upper())
+        
+        self.conn.execute(SQL_DATA_TABLE)
+        self.conn.commit()
+        
+        self.rows = []
+        self.last_commit = time.time()
+    
+    def write(self, frame):
+        """ add a frame (timestamp, data... ) to the data base """
+        
+        frame_time_str_sql = time.strftime(SQL_DATETIME_FORMAT,
+            time.gmtime(frame[0]))
+        
+        self.rows.append((frame[0], frame_time_str_sql) +
+            tuple([round(p, 2) for p in frame[1:]]))
+        
+        if (len(self.rows) >= self.batch_size or
+                time.time() - self.last_commit >= self.commit_interval):
+            self.flush()
+    
+    def last_timestamp(self):
+        """ get the timestamp of the newest frame in the data base
+        
+        return -- the timestamp or None for an empty data base
+        """
+        
+        self.flush()
+        
+        return self.conn.execute('select max(timestamp) from data;').fetchone()[0]
+    
+    def flush(self):
+        """ insert and commit waiting frames """
+        
+        if self.rows:
+            self.conn.executemany(SQL_DATA_INSERT, self.rows)
+            self.rows = []
+        
+        self.conn.commit()
+        self.last_commit = time.time()
+    
+    def close(self):
+        """ commit waiting frames and close the data base """
+        
+        self.flush()
+        self.conn.close()
+
+class PrintSink():
+    """ write polled values as csv lines: time, unit, addr, value
+    
+    a failed read is written as one line: time, unit, error
+    """
+    
+    def __init__(self, f=None):
+        """ f -- a file to write to, default is stdout """
+        
+        self.f = f or sys.stdout
+    
+    def publish(self, unit, timestamp, values):
+        """ write the values of a unit (a dict of addr -> value) """
+        
+        time_str = time.strftime(CSV_DATETIME_FORMAT, time.localtime(timestamp))
+        
+        if values is None:
+            self.f.write("%s,%d,error\n" % (time_str, unit))
+            return
+        
+        for addr in sorted(values):
+            self.f.write("%s,%d,%d,%.02f\n" % (time_str, unit, addr, 
+                values[addr]))
+        
+        self.f.flush()
+    
+    def close(self):
+        """ flush the file """
+        
+        self.f.flush()
+
+class DeadbandFilter():
+    """ report by exception, pass on only values that changed
+    
+    a value is published when it moved more than the deadband from the
+    last published value of its (unit, addr), or when heartbeat seconds
+    passed since it was last published. the deadband is the larger of
+    the absolute deadband and percent of the last published value. failed
+    reads (None values) are always published.
+    
+    last values and publish times are kept in two flat arrays of doubles,
+    indexed by (unit, addr), to keep the state small for many points.
+    """
+    
+    def __init__(self, sink, deadband=0.0, percent=0.0, heartbeat=None):
+        """ create a filter
+        
+        sink -- an object with a publish method, gets the changed values
+        deadband -- absolute change needed to publish a value
+        percent -- change needed to publish a value, in percent of the
+            last published value
+        heartbeat -- max seconds between publishing a value, None for never
+        """
+        
+        self.sink = sink
+        self.deadband = deadband
+        self.ratio = percent / 100.0
+        self.heartbeat = heartbeat
+        
+        # (unit, addr) -> index in the values and times arrays
+        self.index = {}
+        self.values = array('d')
+        self.times = array('d')
+        
+        # statistics
+        self.received = 0
+        self.published = 0
+    
+    def publish(self, unit, timestamp, values):
+        """ publish the changed values of a unit (a dict of addr -> value) """
+        
+        if values is None:
+            self.sink.publish(unit, timestamp, None)
+            return
+        
+        changed = {}
+        for addr, value in values.items():
+            i = self.index.get((unit, addr))
+            
+            if i is None:
+                self.index[(unit, addr)] = len(self.values)
+                self.values.append(value)
+                self.times.append(timestamp)
+                changed[addr] = value
+                continue
+            
+            last = self.values[i]
+            if (abs(value - last) > max(self.deadband, self.ratio * abs(last))
+                    or (value != value) != (last != last)
+                    or (self.heartbeat is not None and
+                        timestamp - self.times[i] >= self.heartbeat)):
+                self.values[i] = value
+                self.times[i] = timestamp
+                changed[addr] = value
+        
+        self.received += len(values)
+        self.published += len(changed)
+        
+        if changed:
+            self.sink.publish(unit, timestamp, changed)
+    
+    def close(self):
+        """ close the sink """
+        
+        self.sink.close()
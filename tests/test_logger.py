@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" test_logger.py
+
+Data log reader tests against a simulated logger
+
+usage:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from ltmodbus import LTModbusTCP
+from ltmodbus_cache import RegisterCache
+from ltmodbus_logger import LTModbusLogger, dump_line, last_csv_timestamp
+from ltmodbus_scheduler import LTModbusScheduler
+from ltmodbus_sink import SQLiteSink
+from ltmodbus_sim import SimLogger, TCPServer
+
+UNIT = 31
+
+# one day after the epoch, frames are 60 seconds apart
+START = 86400
+
+class LoggerTest(unittest.TestCase):
+    """ LTModbusLogger with a register cache """
+    
+    def setUp(self):
+        self.logger = SimLogger(UNIT, start=START)
+        self.server = TCPServer([self.logger])
+        self.server.start()
+        
+        self.soc = LTModbusTCP(self.server.ip, self.server.tcp_port,
+            timeout=0.5)
+        self.soc.cache = RegisterCache(ttl=60)
+        self.soc.open()
+        
+        self.ser = LTModbusLogger(self.soc)
+    
+    def tearDown(self):
+        self.soc.close()
+    
+    def test_cached_frame(self):
+        frame = self.ser.read_data()
+        requests = self.server.requests
+        
+        self.assertEqual(self.ser.read_data(), frame)
+        self.assertEqual(self.server.requests, requests)
+    
+    def test_inc_date_invalidates(self):
+        frame = self.ser.read_data()
+        self.ser.inc_date()
+        
+        next_frame = self.ser.read_data()
+        self.assertEqual(next_frame[0], frame[0] + 60)
+        
+        # the data of the next frame, not the cached data
+        for value, par in zip(next_frame[1:], self.logger.frame(frame[0] + 60)):
+            self.assertAlmostEqual(value, par, places=3)
+    
+    def test_set_date_invalidates(self):
+        frames = list(self.ser.iter_frames(limit=3))
+        
+        self.ser.set_date(2, 1, 1970, 0, 0, 0)
+        self.assertEqual(self.ser.read_data(), frames[0])
+    
+    def test_iter_frames(self):
+        frames = list(self.ser.iter_frames(START + 60, START + 240))
+        
+        self.assertEqual([frame[0] for frame in frames],
+            [START + 60, START + 120, START + 180, START + 240])
+
+class ResumeTest(unittest.TestCase):
+    """ resume reading after the last frame of a sink """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        
+        self.server = TCPServer([SimLogger(UNIT, start=START)])
+        self.server.start()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def opener(self):
+        soc = LTModbusTCP(self.server.ip, self.server.tcp_port, timeout=0.5)
+        soc.open()
+        
+        return soc
+    
+    def run_scheduler(self, filename, limit):
+        scheduler = LTModbusScheduler()
+        scheduler.add('sim', self.opener, UNIT,
+            lambda: SQLiteSink(filename), START, limit=limit, resume=True)
+        
+        return scheduler.run()[('sim', UNIT)]
+    
+    def test_sqlite(self):
+        filename = os.path.join(self.path, 'data.sqlite')
+        
+        self.assertEqual(self.run_scheduler(filename, 5), 5)
+        
+        # the second run starts after the last frame, the last frame is 
+        # not read again
+        self.assertEqual(self.run_scheduler(filename, 5), 5)
+        
+        sink = SQLiteSink(filename)
+        timestamps = [row[0] for row in
+            sink.conn.execute('select timestamp from data order by timestamp;')]
+        sink.close()
+        
+        self.assertEqual(timestamps, [START + 60 * i for i in range(10)])
+    
+    def test_csv(self):
+        filename = os.path.join(self.path, 'data.csv')
+        
+        self.assertEqual(last_csv_timestamp(filename), None)
+        
+        f = open(filename, 'wb')
+        for i in range(3):
+            dump_line(f, None, (START + 60 * i, 1.0, 2.0))
+        f.close()
+        
+        self.assertEqual(last_csv_timestamp(filename), START + 120)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Copyright (C) 2013 Yaacov Zamir <kobi.zamir@gmail.com>
+# Author: Yaacov Zamir (2013)
+
+""" test_ltmodbus.py
+
+Transport tests against simulated units
+
+usage:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from ltmodbus import LTModbusTCP, MBAP_HEADER, float_struct, plan_reads
+from ltmodbus import MAX_READ_COUNT, MAX_READ_GAP
+from ltmodbus import LTModbusTimeout, LTModbusFrameError
+from ltmodbus import LTModbusExceptionResponse, LTModbusConnectionError
+from ltmodbus_retry import RetryPolicy
+from ltmodbus_metrics import Metrics
+from ltmodbus_sim import SimLogger, TCPServer, SLAVE_DEVICE_BUSY
+
+try:
+    from ltmodbus import LTModbusSerial
+    from ltmodbus_sim import RTUSlave
+    import pty
+except ImportError:
+    LTModbusSerial = None
+
+UNIT = 31
+
+def events(metrics, name):
+    """ get the count of an event of the test unit """
+    
+    return metrics.events.get((name, UNIT), 0)
+
+class PlanReadsTest(unittest.TestCase):
+    """ read coalescing limits """
+    
+    def test_gap(self):
+        # a gap of max_gap pars is read, a bigger gap is a new request
+        self.assertEqual(plan_reads([1, 2 + MAX_READ_GAP]),
+            [(1, 2 + MAX_READ_GAP)])
+        self.assertEqual(plan_reads([1, 3 + MAX_READ_GAP]),
+            [(1, 1), (3 + MAX_READ_GAP, 1)])
+    
+    def test_max_count(self):
+        spans = plan_reads(range(1, 3 * MAX_READ_COUNT + 1))
+        
+        self.assertEqual(spans, [(1, MAX_READ_COUNT),
+            (1 + MAX_READ_COUNT, MAX_READ_COUNT),
+            (1 + 2 * MAX_READ_COUNT, MAX_READ_COUNT)])
+    
+    def test_unsorted(self):
+        self.assertEqual(plan_reads([30, 5, 5, 1, 2, 3]), [(1, 5), (30, 1)])
+
+@unittest.skipIf(LTModbusSerial is None, "needs pyserial and a pty")
+class SerialTest(unittest.TestCase):
+    """ LTModbusSerial against a simulated unit on a pty """
+    
+    baudrate = 9600
+    
+    def setUp(self):
+        self.logger = SimLogger(UNIT, start=0)
+        self.slave = RTUSlave([self.logger], baudrate=self.baudrate, seed=1)
+        self.slave.start()
+        
+        self.soc = LTModbusSerial(port=self.slave.port,
+            baudrate=self.baudrate, timeout=1)
+    
+    def tearDown(self):
+        self.soc.close()
+    
+    def assertPars(self, values, addr, count):
+        expected = self.logger.get_pars(addr, count)
+        
+        self.assertEqual(len(values), count)
+        for value, par in zip(values, expected):
+            self.assertAlmostEqual(value, par, places=3)
+    
+    def test_get_par(self):
+        self.assertPars(self.soc.get_par(UNIT, 5975, 18), 5975, 18)
+    
+    def test_timeout_then_next_request(self):
+        # 18 pars take about 80ms at 9600 baud, the answer is cut
+        self.soc.timeout = 0.05
+        self.assertRaises((LTModbusTimeout, LTModbusFrameError),
+            self.soc.get_par, UNIT, 5951, 18)
+        
+        # the rest of the late answer is not the answer of the next request
+        self.soc.timeout = 1
+        self.assertPars(self.soc.get_par(UNIT, 5975, 18), 5975, 18)
+    
+    def test_exception_answer(self):
+        self.slave.busy_rate = 1.0
+        self.soc.retry = RetryPolicy(retries=2)
+        self.soc.hooks = Metrics()
+        
+        t = time.time()
+        try:
+            self.soc.get_par(UNIT, 5975, 18)
+            self.fail("no exception answer")
+        except LTModbusExceptionResponse as e:
+            self.assertEqual(e.code, SLAVE_DEVICE_BUSY)
+        
+        # the short exception answer ends the read, and is not retried
+        self.assertTrue(time.time() - t < 0.5)
+        self.assertEqual(events(self.soc.hooks, 'retry'), 0)
+    
+    def test_crc_error_resync(self):
+        self.slave.corrupt_rate = 1.0
+        self.assertRaises(LTModbusFrameError,
+            self.soc.get_par, UNIT, 5975, 18)
+        
+        self.slave.corrupt_rate = 0.0
+        self.assertPars(self.soc.get_par(UNIT, 5975, 18), 5975, 18)
+    
+    def test_retry_learns_transfer_time(self):
+        self.soc.retry = RetryPolicy(retries=2)
+        self.soc.hooks = Metrics()
+        
+        # short answers first, then long answers
+        for i in range(25):
+            self.soc.get_par(UNIT, 5941, 1)
+        for i in range(5):
+            self.soc.get_par(UNIT, 5941, 28)
+        
+        self.assertEqual(events(self.soc.hooks, 'retry'), 0)
+
+class TCPTest(unittest.TestCase):
+    """ LTModbusTCP against a simulated gateway """
+    
+    def setUp(self):
+        self.logger = SimLogger(UNIT, start=0)
+        self.server = TCPServer([self.logger], latency=0.005)
+        self.server.start()
+        
+        self.soc = LTModbusTCP(self.server.ip, self.server.tcp_port,
+            window=4, timeout=0.5)
+        self.soc.open()
+    
+    def tearDown(self):
+        self.soc.close()
+    
+    def test_get_pars_pipelined(self):
+        requests = [(UNIT, 5941 + i, 1) for i in range(8)]
+        answers = self.soc.get_pars(requests)
+        
+        self.assertEqual([list(answer) for answer in answers],
+            [self.logger.get_pars(addr, 1) for unit, addr, count in requests])
+    
+    def test_dead_unit_is_skipped(self):
+        self.soc.retry = RetryPolicy(retries=0, dead_after=2,
+            max_timeout=0.2)
+        
+        for i in range(2):
+            self.assertRaises(LTModbusTimeout, self.soc.read_many, 33,
+                [5941, 5990])
+        
+        # a dead unit does not wait for the window
+        t = time.time()
+        self.assertRaises(LTModbusTimeout, self.soc.read_many, 33,
+            [5941, 5990])
+        self.assertTrue(time.time() - t < 0.1)
+        
+        # other units are still read
+        self.assertEqual(len(self.soc.read_many(UNIT, [5941, 5990])), 2)
+    
+    def test_peer_close(self):
+        self.soc.get_par(UNIT, 5941, 1)
+        
+        # the connection breaks under the module
+        self.soc.soc.shutdown(socket.SHUT_RDWR)
+        self.assertRaises(LTModbusConnectionError,
+            self.soc.get_par, UNIT, 5941, 1)
+        
+        # the module reconnected
+        self.assertEqual(self.soc.get_par(UNIT, 5941, 1)[0], 1.0)
+    
+    def test_peer_close_retried(self):
+        self.soc.retry = RetryPolicy(retries=2, backoff=0.01)
+        self.soc.get_par(UNIT, 5941, 1)
+        
+        self.soc.soc.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.soc.get_par(UNIT, 5941, 1)[0], 1.0)
+
+class PartialFrameTest(unittest.TestCase):
+    """ a reply split across the answer timeout """
+    
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.connections = 0
+        
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+    
+    def tearDown(self):
+        self.server.close()
+    
+    def _accept(self):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except socket.error:
+                return
+            
+            self.connections += 1
+            thread = threading.Thread(target=self._serve,
+                args=(connection, self.connections == 1))
+            thread.daemon = True
+            thread.start()
+    
+    def _serve(self, connection, split):
+        """ answer 1.0, 2.0 to all requests, the first connection sends
+        its first reply in two parts
+        """
+        
+        try:
+            while True:
+                request = connection.recv(256)
+                if not request:
+                    return
+                
+                transaction_id = MBAP_HEADER.unpack_from(request)[0]
+                answer = (request[6:8] + b'\x08' +
+                    float_struct(2).pack(1.0, 2.0))
+                frame = MBAP_HEADER.pack(transaction_id, 0,
+                    len(answer)) + answer
+                
+                if split:
+                    split = False
+                    connection.sendall(frame[:5])
+                    time.sleep(0.3)
+                    connection.sendall(frame[5:])
+                else:
+                    connection.sendall(frame)
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+    
+    def test_partial_frame(self):
+        ip, port = self.server.getsockname()
+        soc = LTModbusTCP(ip, port, timeout=0.1)
+        soc.open()
+        
+        try:
+            self.assertRaises(LTModbusTimeout, soc.get_par, UNIT, 5975, 2)
+            
+            # the rest of the split reply is not read as the next reply
+            time.sleep(0.3)
+            self.assertEqual(soc.get_par(UNIT, 5941, 2), (1.0, 2.0))
+            self.assertEqual(self.connections, 2)
+        finally:
+            soc.close()
+
+if __name__ == '__main__':
+    unittest.main()